@@ -0,0 +1,168 @@
+import re
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from deepsearch.prompts import PROMPTS
+
+# the text of each template before its first placeholder identifies the prompt
+_PREFIXES = sorted(((template.split("{")[0], name) for name, template in PROMPTS.items()), key=lambda p: -len(p[0]))
+
+def classify_prompt(prompt: str) -> str | None:
+    for prefix, name in _PREFIXES:
+        if prompt.startswith(prefix):
+            return name
+    return None
+
+def _field(prompt: str, label: str) -> str:
+    """The text following the `label` line in the input section of a rendered prompt, up to the next blank line."""
+    match = re.compile(rf"^{re.escape(label)}[ \t]*\n", re.M).search(prompt, max(prompt.rfind("---Input---"), 0))
+    if match is None:
+        return ""
+    return prompt[match.end():].split("\n\n")[0].strip()
+
+def _topic(query: str) -> str:
+    # capitalised names after the leading question word
+    names = re.findall(r"[A-Z][a-z]+(?: [A-Z][a-z]+)*", query.split(" ", 1)[-1])
+    return " ".join(names[:2]) or query[:60]
+
+def canned_response(prompt: str, yes_rate: float = 0.5, filler_words: int = 40) -> str:
+    """A well-formed response for a deepsearch prompt, deterministic in the prompt text."""
+    rng = random.Random(hashlib.md5(prompt.encode()).digest())
+    filler = " ".join(rng.choice(["evidence", "record", "source", "fact", "detail", "entity", "relation"]) for _ in range(filler_words))
+    name = classify_prompt(prompt)
+
+    if name == "keywords_extraction":
+        queries = re.findall(r"^Query: (.*)$", prompt, flags=re.M)
+        topic = _topic(queries[-1] if queries else "")
+        return json.dumps({"high_level_keywords": [topic], "low_level_keywords": topic.split()})
+    if name == "query_decomposition_deep":
+        topic = _topic(_field(prompt, "Main Query:"))
+        return json.dumps({
+            "Sub-query 1": f"Who is {topic}?",
+            "Sub-query 2": "What is #1 associated with?",
+            "Sub-query 3": "Where is #2 located?",
+        }, indent=4)
+    if name == "query_decomposition_deep_kg":
+        topic = _topic(_field(prompt, "Main Query:"))
+        return (
+            "{\n"
+            f'    "Sub-query 1": [("{topic}", "is associated with", "Entity#1")],\n'
+            '    "Sub-query 2": [("Entity#1", "is located in", "Entity#2")]\n'
+            "}"
+        )
+    if name in ("query_completer", "kg_query_completer"):
+        sub_query = _field(prompt, "Sub-query:")
+        # fill the placeholders with a name mentioned in the decomposition or history
+        name = _topic(_field(prompt, "Context Data:")) or "it"
+        return re.sub(r"Entity#\d+|#\d+", name, sub_query)
+    if name in ("retrieval_text_summarization", "knowledge_graph_summarization"):
+        return f"Summary: {filler}."
+    if name in ("answer_generation", "answer_generation_deep"):
+        return f"{_topic(_field(prompt, 'Query:')) or 'Unknown'}. Reasoning: {filler}."
+    if name == "evidence_verification":
+        return f"Analysis: {filler}. {'Yes' if rng.random() < yes_rate else 'No'}"
+    if name == "query_expansion":
+        return json.dumps([f"What else is known about {_topic(_field(prompt, 'Main Query:'))}?", "Which sources confirm it?"])
+    return f"OK. {filler}"
+
+class MockLLMServer:
+    """
+    Local OpenAI-compatible chat completions server for offline benchmarks.
+    Each request sleeps for a log-normally distributed latency (median
+    `latency_median` seconds) plus `prefill_per_1k` seconds per thousand
+    prompt tokens, then returns `canned_response` for the prompt.
+    """
+
+    def __init__(self, port: int, latency_median: float = 0.2, latency_sigma: float = 0.5, prefill_per_1k: float = 0.0, yes_rate: float = 0.5):
+        self.port = port
+        self.latency_median = latency_median
+        self.latency_sigma = latency_sigma
+        self.prefill_per_1k = prefill_per_1k
+        self.yes_rate = yes_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._server.daemon_threads = True
+
+    def latency(self, prompt_tokens: int) -> float:
+        base = self.latency_median * random.lognormvariate(0, self.latency_sigma) if self.latency_median > 0 else 0.0
+        return base + self.prefill_per_1k * prompt_tokens / 1000
+
+    def complete(self, request: dict) -> dict:
+        prompt = request["messages"][-1]["content"]
+        prompt_tokens = sum(len(m["content"]) for m in request["messages"]) // 4
+        with self._lock:
+            self.requests += 1
+        time.sleep(self.latency(prompt_tokens))
+        content = canned_response(prompt, self.yes_rate)
+        completion_tokens = len(content) // 4
+        return {
+            "id": f"mock-{self.requests}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "mock"),
+            "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status: int, payload: dict):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+                else:
+                    self._send(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send(404, {"error": {"message": "not found"}})
+                    return
+                request = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                self._send(200, server.complete(request))
+
+        return Handler
+
+    @property
+    def base_url(self) -> str:
+        # port 0 binds any free port
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1/"
+
+    def serve_forever(self):
+        self._server.serve_forever()
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible LLM server answering the deepsearch prompts")
+    parser.add_argument("--port", default=18000, type=int)
+    parser.add_argument("--latency_median", default=0.2, type=float, help="Median seconds per request.")
+    parser.add_argument("--latency_sigma", default=0.5, type=float, help="Log-normal shape of the latency distribution; 0 makes it constant.")
+    parser.add_argument("--prefill_per_1k", default=0.0, type=float, help="Extra seconds per 1000 prompt tokens.")
+    parser.add_argument("--yes_rate", default=0.5, type=float, help="Fraction of evidence verifications answered with Yes.")
+    args = parser.parse_args()
+
+    MockLLMServer(args.port, args.latency_median, args.latency_sigma, args.prefill_per_1k, args.yes_rate).serve_forever()
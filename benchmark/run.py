@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import argparse
+import tempfile
+
+import numpy as np
+
+from benchmark.mock_llm import MockLLMServer
+from benchmark.synthetic_kb import SyntheticGraphRAG, HashingEmbedder, WhitespaceTokenizer
+from pipeline import naive_grag_reasoning, graph_search_reasoning, vanilla_llm_reasoning, naive_rag_reasoning
+from runner import run_batch
+from utils import vdb_retrieve_batch
+from vdb import build_index, encode_documents
+from llm.client import close_openai_clients
+from llm.cache import set_llm_cache_enabled
+from llm.limiter import set_llm_concurrency
+from llm.retry import retry_stats
+from llm.endpoints import set_llm_endpoints
+from embedding import set_embed_model
+from tokens import set_tokenizer
+from llm.prefix import prefix_stats, set_prefix_stats_enabled
+from deepsearch.layout import LAYOUTS, set_prompt_layout
+from config import PROMPT_LAYOUT
+
+METHODS = ["graphsearch", "grag", "naiverag", "vanillallm"]
+
+def summarize(method: str, latencies: list[float], wall: float, questions: int, llm_calls: int, requests: int, prompt_tokens: int = 0, shared_prefix_tokens: int = 0) -> dict:
+    answered = len(latencies)
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if latencies else (0.0, 0.0, 0.0)
+    return {
+        "method": method,
+        "questions": questions,
+        "answered": answered,
+        "qps": answered / wall if wall > 0 else 0.0,
+        "p50": float(p50),
+        "p95": float(p95),
+        "p99": float(p99),
+        "llm_calls_per_question": llm_calls / answered if answered else 0.0,
+        "requests_per_question": requests / answered if answered else 0.0,
+        # only graphsearch measures prefix sharing; the other methods make one call per question
+        "shared_prefix_ratio": shared_prefix_tokens / prompt_tokens if prompt_tokens else None,
+    }
+
+def format_table(rows: list[dict]) -> str:
+    header = f"{'method':<12} {'answered':>8} {'qps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'calls/q':>8} {'reqs/q':>8} {'prefix':>8}"
+    lines = [header, "-" * len(header)]
+    for r in rows:
+        lines.append(
+            f"{r['method']:<12} {r['answered']:>8} {r['qps']:>8.2f} {r['p50']:>8.3f} {r['p95']:>8.3f} {r['p99']:>8.3f} "
+            f"{r['llm_calls_per_question']:>8.1f} {r['requests_per_question']:>8.1f} "
+            + (f"{r['shared_prefix_ratio']:>8.1%}" if r["shared_prefix_ratio"] is not None else f"{'-':>8}")
+        )
+    return "\n".join(lines)
+
+async def run_method(questions: list, reason, output_file: str, concurrency: int):
+    try:
+        start = time.perf_counter()
+        latencies = await run_batch(questions, reason, output_file, concurrency)
+        return latencies, time.perf_counter() - start
+    finally:
+        await close_openai_clients()
+
+def benchmark(methods: list[str], num_questions: int, concurrency: int, llm_concurrency: int, server: MockLLMServer, num_entities: int = 200, top_k: int = 5, retrieval_latency: float = 0.02, seed: int = 0, prompt_layout: str = PROMPT_LAYOUT) -> list[dict]:
+    """
+    Answer `num_questions` synthetic questions with each method against the
+    mock LLM `server` and return qps, latency percentiles and LLM calls per
+    question (and, for graphsearch, the share of prompt tokens that repeat an
+    earlier prompt's prefix) for every method. Nothing leaves the machine and neither the
+    LLM nor the embedding cache is reused, so runs are comparable. Token
+    budgets are counted in words.
+    """
+    set_llm_endpoints([server.base_url])
+    set_llm_cache_enabled(False)
+    set_llm_concurrency(llm_concurrency)
+    embed_model = HashingEmbedder()
+    set_embed_model(embed_model)
+    set_tokenizer(WhitespaceTokenizer())
+    set_prompt_layout(prompt_layout)
+    # measured for both layouts, so they can be compared
+    set_prefix_stats_enabled(True)
+
+    rows = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for method in methods:
+            # a fresh knowledge base per method, so no retrieval cache carries over
+            kb = SyntheticGraphRAG(num_entities=num_entities, top_k=top_k, retrieval_latency=retrieval_latency, seed=seed)
+            questions = kb.questions(num_questions, seed=seed + 1)
+
+            if method == "vanillallm":
+                reason = lambda question: vanilla_llm_reasoning(question)
+            elif method == "naiverag":
+                index = build_index(encode_documents(embed_model, kb.documents, metric="ip"), kind="flat", metric="ip")
+                texts = [item["question"] for item in questions]
+                retrieved = dict(zip(texts, vdb_retrieve_batch(texts, kb.documents, index, embed_model, top_k)))
+                reason = lambda question, index=index, retrieved=retrieved: naive_rag_reasoning(question, kb.documents, index, top_k, retrieved.get(question))
+            elif method == "grag":
+                reason = lambda question, kb=kb: naive_grag_reasoning(question, kb)
+            elif method == "graphsearch":
+                reason = lambda question, kb=kb: graph_search_reasoning(question, kb)
+
+            calls_before = sum(s["calls"] for s in retry_stats().values())
+            requests_before = server.requests
+            prefix_before = prefix_stats()
+            latencies, wall = asyncio.run(run_method(questions, reason, os.path.join(tmp, f"{method}.jsonl"), concurrency))
+            row = summarize(
+                method, latencies, wall, len(questions),
+                llm_calls=sum(s["calls"] for s in retry_stats().values()) - calls_before,
+                requests=server.requests - requests_before,
+                prompt_tokens=prefix_stats().get("prompt_tokens", 0) - prefix_before.get("prompt_tokens", 0),
+                shared_prefix_tokens=prefix_stats().get("shared_prefix_tokens", 0) - prefix_before.get("shared_prefix_tokens", 0),
+            )
+            logging.info(f"{method}: {row}")
+            rows.append(row)
+    return rows
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.WARNING)
+
+    parser = argparse.ArgumentParser(description="Offline throughput and latency benchmark against a mock LLM and a synthetic graph KB")
+    parser.add_argument("-m", "--methods", nargs="+", default=METHODS, choices=METHODS, help="Reasoning methods to benchmark.")
+    parser.add_argument("-n", "--questions", default=50, type=int, help="Synthetic questions per method.")
+    parser.add_argument("-c", "--concurrency", default=8, type=int, help="Questions in flight at once.")
+    parser.add_argument("--llm_concurrency", default=32, type=int, help="Global cap on in-flight LLM requests.")
+    parser.add_argument("--entities", default=200, type=int, help="Entities in the synthetic graph.")
+    parser.add_argument("-k", "--top_k", default=5, type=int, help="top retrieved items.")
+    parser.add_argument("--retrieval_latency", default=0.02, type=float, help="Seconds each graph retrieval sleeps.")
+    parser.add_argument("--latency_median", default=0.2, type=float, help="Median seconds per mock LLM request.")
+    parser.add_argument("--latency_sigma", default=0.5, type=float, help="Log-normal shape of the mock LLM latency; 0 makes it constant.")
+    parser.add_argument("--prefill_per_1k", default=0.0, type=float, help="Extra mock LLM seconds per 1000 prompt tokens.")
+    parser.add_argument("--yes_rate", default=0.5, type=float, help="Fraction of evidence verifications the mock LLM answers with Yes.")
+    parser.add_argument("--prompt_layout", default=PROMPT_LAYOUT, choices=LAYOUTS, help="Prompt assembly mode.")
+    parser.add_argument("--port", default=0, type=int, help="Port for the mock LLM server; 0 picks a free one.")
+    parser.add_argument("--seed", default=0, type=int)
+    parser.add_argument("-o", "--output", default=None, help="Also write the results as JSON to this file.")
+    args = parser.parse_args()
+
+    server = MockLLMServer(args.port, args.latency_median, args.latency_sigma, args.prefill_per_1k, args.yes_rate).start()
+    try:
+        rows = benchmark(
+            args.methods, args.questions, args.concurrency, args.llm_concurrency, server,
+            num_entities=args.entities, top_k=args.top_k, retrieval_latency=args.retrieval_latency, seed=args.seed,
+            prompt_layout=args.prompt_layout,
+        )
+    finally:
+        server.shutdown()
+
+    print(format_table(rows))
+    if args.output is not None:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"config": vars(args), "results": rows}, f, indent=2)
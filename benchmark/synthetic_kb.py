@@ -0,0 +1,180 @@
+import re
+import asyncio
+import hashlib
+import random
+
+import numpy as np
+
+from graphrags.base import GraphRAGBase
+from graphrags.records import StructuredContext, parse_csv_sections, render_csv_block
+from deepsearch.components import answer_generation
+from utils import normalize
+
+CONTEXT_SECTIONS = {
+    "entities": ("-----Entities-----", "entity"),
+    "relationships": ("-----Relationships-----", "relationship"),
+    "sources": ("-----Sources-----", "chunk"),
+}
+
+_SYLLABLES = ["al", "bar", "cor", "dan", "el", "fen", "gar", "hal", "is", "jor", "kel", "lin", "mor", "nad", "or", "pel", "quin", "ros", "sal", "tor", "ul", "vin", "wen", "yar"]
+_TYPES = ["person", "organization", "location", "event", "work"]
+_RELATIONS = ["founded", "was born in", "is located in", "created", "married", "succeeded", "is a member of", "studied at"]
+
+def _name(rng: random.Random) -> str:
+    return " ".join("".join(rng.choice(_SYLLABLES) for _ in range(rng.randint(2, 3))).capitalize() for _ in range(2))
+
+class HashingEmbedder:
+    """Deterministic bag-of-words stand-in for the SentenceTransformer model, so naive RAG runs without downloading weights."""
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def get_sentence_embedding_dimension(self) -> int:
+        return self.dim
+
+    def encode(self, texts, normalize_embeddings: bool = False, **kwargs) -> np.ndarray:
+        embeddings = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, text in enumerate(texts):
+            for word in normalize(text):
+                embeddings[i, int(hashlib.md5(word.encode()).hexdigest()[:8], 16) % self.dim] += 1.0
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+class WhitespaceTokenizer:
+    """Word-level stand-in for the HuggingFace tokenizer, so token budgets apply without downloading one."""
+
+    def encode(self, text: str, **kwargs) -> list[str]:
+        return re.findall(r"\S+\s*", text)
+
+    def decode(self, tokens: list[str], **kwargs) -> str:
+        return "".join(tokens)
+
+    def __call__(self, text: str, return_offsets_mapping: bool = False, **kwargs) -> dict:
+        matches = list(re.finditer(r"\S+\s*", text))
+        encoding = {"input_ids": [m.group() for m in matches]}
+        if return_offsets_mapping:
+            encoding["offset_mapping"] = [m.span() for m in matches]
+        return encoding
+
+class SyntheticGraphRAG(GraphRAGBase):
+    """
+    Small in-memory knowledge graph with the GraphRAGBase interface.
+
+    Entities, relationships and one source passage per entity are generated
+    from `seed`; retrieval ranks entities by word overlap with the query and
+    renders them in MiniRAG's CSV context format after sleeping
+    `retrieval_latency` seconds, so the reasoning pipeline can be benchmarked
+    without a real graph store.
+    """
+
+    def __init__(self, num_entities: int = 200, degree: int = 3, top_k: int = 5, retrieval_latency: float = 0.02, seed: int = 0):
+        rng = random.Random(seed)
+        self.retrieval_latency = retrieval_latency
+        self.entities = [(_name(rng), rng.choice(_TYPES)) for _ in range(num_entities)]
+        self.relationships = [
+            (i, j, rng.choice(_RELATIONS))
+            for i in range(num_entities)
+            for j in rng.sample(range(num_entities), degree)
+            if i != j
+        ]
+        self.neighbours = {i: [] for i in range(num_entities)}
+        for r, (i, j, _) in enumerate(self.relationships):
+            self.neighbours[i].append(r)
+            self.neighbours[j].append(r)
+        self.documents = [self._passage(i) for i in range(num_entities)]
+        self._index = {}
+        for i, (name, _) in enumerate(self.entities):
+            for word in normalize(name):
+                self._index.setdefault(word, []).append(i)
+        super().__init__(grag=None, QueryParam=None, grag_mode="synthetic", top_k=top_k)
+
+    def _passage(self, i: int) -> str:
+        name, entity_type = self.entities[i]
+        facts = [f"{self.entities[a][0]} {relation} {self.entities[b][0]}." for a, b, relation in (self.relationships[r] for r in self.neighbours.get(i, []))]
+        return f"{name} is a {entity_type}. " + " ".join(facts)
+
+    def questions(self, n: int, seed: int = 1) -> list[dict]:
+        """Two-hop questions along generated relationships."""
+        rng = random.Random(seed)
+        questions = []
+        for k in range(n):
+            a, b, relation = rng.choice(self.relationships)
+            follow = [self.relationships[r] for r in self.neighbours[b] if self.relationships[r][0] == b] or [(b, a, "is related to")]
+            _, c, relation2 = rng.choice(follow)
+            questions.append({
+                "id": str(k),
+                "question": f"What did the entity that {self.entities[a][0]} {relation} {relation2}?",
+                "answer": self.entities[c][0],
+            })
+        return questions
+
+    def init_graphrag(self, working_dir: str, EMBED_MODEL):
+        return None
+
+    def _retrieve(self, question: str) -> list[int]:
+        scores = {}
+        for word in normalize(question):
+            for i in self._index.get(word, ()):
+                scores[i] = scores.get(i, 0) + 1
+        ranked = sorted(scores, key=lambda i: (-scores[i], i))[:self.top_k]
+        if len(ranked) < self.top_k:
+            # pad with a deterministic pseudo-random choice so every query returns context
+            seed = int(hashlib.md5(question.encode()).hexdigest()[:8], 16)
+            ranked += [i for i in random.Random(seed).sample(range(len(self.entities)), self.top_k) if i not in ranked][:self.top_k - len(ranked)]
+        return ranked
+
+    async def _aquery_context(self, question: str):
+        await asyncio.sleep(self.retrieval_latency)
+        ranked = self._retrieve(question)
+        relationship_ids = list(dict.fromkeys(r for i in ranked for r in self.neighbours[i]))[:2 * self.top_k]
+
+        entity_rows = [f'{k},\t{self.entities[i][0]},\t{self.entities[i][1]},\t{self.documents[i][:120]}' for k, i in enumerate(ranked)]
+        relationship_rows = [
+            f"{k},\t{self.entities[a][0]},\t{self.entities[b][0]},\t{self.entities[a][0]} {relation} {self.entities[b][0]},\t{relation},\t1.0"
+            for k, (a, b, relation) in enumerate(self.relationships[r] for r in relationship_ids)
+        ]
+        source_rows = [f"{k},\t{self.documents[i]}" for k, i in enumerate(ranked)]
+        return f"""-----Entities-----
+```csv
+id,\tentity,\ttype,\tdescription
+{chr(10).join(entity_rows)}
+```
+-----Relationships-----
+```csv
+id,\tsource,\ttarget,\tdescription,\tkeywords,\tweight
+{chr(10).join(relationship_rows)}
+```
+-----Sources-----
+```csv
+id,\tcontent
+{chr(10).join(source_rows)}
+```
+"""
+
+    def parse_context(self, context_data: str) -> StructuredContext:
+        return parse_csv_sections(context_data, CONTEXT_SECTIONS)
+
+    def render_context(self, context: StructuredContext, filter_type: str) -> str:
+        def section(name):
+            return render_csv_block(context.headers.get(name, ""), context.section_records(name))
+
+        if filter_type == "semantic":
+            return f"""-----Sources-----
+```csv
+{section("sources")}
+```
+"""
+        return f"""-----Entities-----
+```csv
+{section("entities")}
+```
+-----Relationships-----
+```csv
+{section("relationships")}
+```
+"""
+
+    async def aquery_answer(self, question: str):
+        # one retrieval plus one generation call, like a backend's own query path
+        return await answer_generation(question, await self.aquery_context(question))
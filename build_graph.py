@@ -1,30 +1,53 @@
+import asyncio
+import logging
 import argparse
 from dotenv import load_dotenv
 
-from graphrags import initialize_rag
+from pipeline import initialize_grag
 from utils import load_vdb
+from vdb import open_corpus
+from ingest import IngestCheckpoint, iter_documents, ingest
+from dedup import Deduplicator
+from llm.client import close_openai_clients
+from llm.limiter import get_llm_limiter
+from embedding import get_embedding_cache
+from config import INGEST_BATCH_SIZE, DEDUP_NEAR_THRESHOLD
+
+async def run_ingest(grag_method, documents, checkpoint, batch_size):
+    try:
+        return await ingest(grag_method, documents, checkpoint, batch_size)
+    finally:
+        checkpoint.close()
+        await close_openai_clients()
+        logging.info(f"LLM limiter: {get_llm_limiter().stats()}")
+        get_embedding_cache().flush()
 
 if __name__ == "__main__":
     load_dotenv()
+    logging.basicConfig(level=logging.INFO)
 
     parser = argparse.ArgumentParser(description="DeepGraphRAG CLI")
     parser.add_argument("-d", "--dataset", default="musique", choices=["hotpotqa", "musique", "2wikimultihopqa", "agriculture", "hypertension", "legal"], help="Dataset to use.")
-    parser.add_argument("-g", "--graphrag", default="lightrag", choices=["lightrag", "minirag", "nano", "pathrag", "hipporag", "hypergraphrag"], help="GraphRAG to use.")
+    parser.add_argument("-m", "--method", default="grag", choices=["grag", "naiverag"], help="Build the graph KB (grag) or the naive RAG vector index (naiverag).")
+    parser.add_argument("-g", "--graphrag", default="lightrag", choices=["lightrag", "minirag", "pathrag", "hypergraphrag"], help="GraphRAG to use.")
+    parser.add_argument("-b", "--batch_size", default=INGEST_BATCH_SIZE, type=int, help="Documents per insert call.")
+    parser.add_argument("--dedup", default="exact", choices=["none", "exact", "near"], help="Skip passages that repeat an earlier one exactly, or also nearly (opt-in: passages differing in one fact can count as near duplicates).")
+    parser.add_argument("--dedup_threshold", default=DEDUP_NEAR_THRESHOLD, type=float, help="Estimated Jaccard similarity above which passages count as near duplicates.")
     args = parser.parse_args()
 
-    if args.method in ["graphsearch", "grag"]:
-        grag, grag_mode, QueryParam = initialize_rag(grag_name=args.graphrag, dataset=args.dataset)
-
-    if args.method in ["naiverag"]:
+    if args.method == "naiverag":
+        load_vdb(args.dataset, open_corpus(args.dataset))
+    else:
+        grag_method = initialize_grag(grag_name=args.graphrag, top_k=5, dataset=args.dataset)
         corpus_file = f"./datasets/contexts/{args.dataset}.txt"
-        with open(corpus_file, "r", encoding="utf-8") as f:
-            documents = f.readlines()
-        index, embed_model = load_vdb(args.dataset, documents)
-    
-    corpus_file = f"./datasets/contexts/{args.dataset}.txt"
-    with open(corpus_file, "r", encoding="utf-8") as f:
-        if args.dataset in ["hotpotqa", "musique", "2wikimultihopqa"]:
-            lines = f.readlines()
-            grag.insert(lines)
-        elif args.dataset in ["agriculture", "hypertension", "legal"]:
-            grag.insert(f.read())
\ No newline at end of file
+        # multi-hop corpora hold one passage per line; the domain corpora are a single document
+        one_per_line = args.dataset in ["hotpotqa", "musique", "2wikimultihopqa"]
+        documents = iter_documents(corpus_file, one_per_line=one_per_line)
+        deduplicator = None
+        if one_per_line and args.dedup != "none":
+            deduplicator = Deduplicator(near_threshold=args.dedup_threshold if args.dedup == "near" else None)
+            documents = deduplicator.filter(documents)
+        checkpoint = IngestCheckpoint(f"./graphkb/{args.graphrag}/{args.dataset}/ingest_checkpoint.txt")
+        asyncio.run(run_ingest(grag_method, documents, checkpoint, args.batch_size))
+        if deduplicator is not None:
+            logging.info(deduplicator.report())
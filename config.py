@@ -1,6 +1,69 @@
 LLM_BASE_URL = "http://192.168.190.8:8000/v1/"
+LLM_BASE_URLS = [LLM_BASE_URL]  # replicas serving MODEL_NAME; requests are load-balanced across them
 LLM_API_KEY = "NONE"
 MODEL_NAME = "Qwen2.5-32B-Instruct"
 HUGGINGFACE_MODEL_NAME = "Qwen/Qwen2.5-32B-Instruct"
 EMBED_MODEL_NAME = "jinaai/jina-embeddings-v3"
-GRAG_MODE = {"lightrag": "hybrid", "minirag": "light", "hypergraphrag": "hybrid", "pathrag": "hybrid"}
\ No newline at end of file
+GRAG_MODE = {"lightrag": "hybrid", "minirag": "light", "hypergraphrag": "hybrid", "pathrag": "hybrid"}
+LLM_MAX_CONNECTIONS = 64
+LLM_MAX_KEEPALIVE_CONNECTIONS = 32
+LLM_KEEPALIVE_EXPIRY = 60.0
+LLM_TIMEOUT = 600.0
+LLM_CACHE_ENABLED = True
+LLM_CACHE_PATH = "./db/llm_cache.sqlite"
+LLM_CACHE_MAX_ENTRIES = 200000
+LLM_CACHE_TTL = None  # seconds; None keeps entries until evicted by size
+EXPANSION_MAX_CONCURRENCY = 4
+RETRIEVAL_CACHE_SIZE = 0  # cross-question retrieval LRU; the per-question memo is always on
+LLM_MIN_CONCURRENCY = 4
+LLM_INITIAL_CONCURRENCY = 16
+LLM_MAX_CONCURRENCY = 32
+LLM_LATENCY_TARGET = None  # seconds; slower responses count as congestion when set
+LLM_CALL_TIMEOUT = 180.0  # per attempt, excluding time spent queued in the limiter
+LLM_MAX_RETRIES = 3
+LLM_BACKOFF_BASE = 1.0
+LLM_BACKOFF_MAX = 30.0
+# deepsearch stages whose calls are duplicated if still running after LLM_HEDGE_DELAY seconds,
+# e.g. ("query_completer", "kg_query_completer", "answer_generation") on the sub-query critical path
+LLM_HEDGE_STAGES = ()
+LLM_HEDGE_DELAY = 20.0
+LLM_ROUTING = "least_outstanding"  # or "latency"
+LLM_SESSION_AFFINITY = True  # keep one question on one replica so its prefix cache stays warm
+LLM_EJECT_AFTER_FAILURES = 3
+LLM_EJECT_SECONDS = 30.0
+LLM_HEALTH_CHECK_INTERVAL = 15.0
+EMBED_MAX_BATCH_SIZE = 64
+EMBED_MAX_WAIT = 0.005  # seconds an encode request waits for others to share its batch
+EMBED_CACHE_SIZE = 20000  # in-memory LRU entries
+EMBED_DISK_CACHE_PATH = None  # e.g. "./db/embed_cache/jina-embeddings-v3" to persist embeddings as float16
+VDB_INDEX = "flat"  # naive RAG index: "flat", "ivfpq", "hnsw" or "sq8"
+VDB_METRIC = "l2"  # or "ip" over normalised embeddings
+VDB_IVF_NLIST = None  # None picks ~4*sqrt(corpus size)
+VDB_PQ_M = 64  # PQ sub-quantizers; must divide the embedding dimension
+VDB_HNSW_M = 32
+VDB_HNSW_EF_CONSTRUCTION = 200
+VDB_NPROBE = 16
+VDB_EF_SEARCH = 64
+VDB_TRAIN_SAMPLE = 100000  # vectors sampled to train IVF-PQ / SQ8
+VDB_MMAP = True  # memory-map saved indexes instead of reading them into RAM
+INGEST_BATCH_SIZE = 64  # documents per graph insert call; batches run one at a time, each in parallel up to the backend's max_parallel_insert
+DEDUP_NEAR_THRESHOLD = 0.9  # estimated Jaccard similarity of word shingles; None keeps near duplicates
+DEDUP_NUM_PERM = 64  # MinHash permutations
+DEDUP_SHINGLE_SIZE = 3  # words per shingle
+# context tokens per deepsearch stage, counted with HUGGINGFACE_MODEL_NAME's tokenizer; records are ranked and
+# trimmed to fit, and older history drops its retrieved context first. Remove a stage to leave it unbudgeted.
+CONTEXT_TOKEN_BUDGETS = {
+    "query_completer": 4000,
+    "kg_query_completer": 4000,
+    "text_summary": 6000,
+    "kg_summary": 6000,
+    "answer_generation": 6000,
+    "answer_generation_deep": 12000,
+    "evidence_verification": 12000,
+    "query_expansion": 12000,
+}
+TOKEN_COUNT_CACHE_SIZE = 50000
+TOKEN_COUNT_CACHE_MAX_CHARS = 4000  # longer texts are counted without caching
+CONTEXT_DEDUP = True  # send each retrieved record to the LLM once per question where later steps see its summary
+PROMPT_LAYOUT = "interleaved"  # or "prefix_cache": instructions, then retrieval history, then per-call inputs
+PREFIX_STATS = False  # measure shared prompt prefixes; always on with the prefix_cache layout or tracing
@@ -0,0 +1,127 @@
+import zlib
+import hashlib
+import logging
+import argparse
+from collections import defaultdict
+
+import numpy as np
+
+from utils import normalize
+from config import DEDUP_NEAR_THRESHOLD, DEDUP_NUM_PERM, DEDUP_SHINGLE_SIZE
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+def lsh_bands(num_perm: int, threshold: float) -> tuple[int, int]:
+    """
+    (bands, rows) with bands * rows <= num_perm whose LSH S-curve midpoint
+    (1 / bands) ** (1 / rows) is closest to `threshold`.
+    """
+    candidates = [(b, num_perm // b) for b in range(1, num_perm + 1)]
+    return min(candidates, key=lambda br: abs((1 / br[0]) ** (1 / br[1]) - threshold))
+
+class Deduplicator:
+    """
+    Streaming filter that drops documents identical to an earlier one after
+    normalisation (lowercase, no punctuation or articles) and, when
+    `near_threshold` is set, documents whose estimated Jaccard similarity of
+    word shingles to an earlier kept document is at least `near_threshold`.
+    Near duplicates are found with MinHash signatures and LSH banding, so each
+    document is compared only against the few that share a band.
+    """
+
+    def __init__(self, near_threshold: float | None = DEDUP_NEAR_THRESHOLD, num_perm: int = DEDUP_NUM_PERM, shingle_size: int = DEDUP_SHINGLE_SIZE, seed: int = 1):
+        self.near_threshold = near_threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # a < 2**32 and crc32 shingle hashes < 2**32, so a * x cannot overflow uint64
+        self._a = rng.integers(1, 1 << 32, size=num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        if near_threshold is not None:
+            self.bands, self.rows = lsh_bands(num_perm, near_threshold)
+
+        self._exact = set()
+        self._buckets = [defaultdict(list) for _ in range(self.bands if near_threshold is not None else 0)]
+        self._signatures = []
+        self._positions = []  # stream position of each kept document with a signature
+
+        self.stats = {"docs": 0, "kept": 0, "exact_duplicates": 0, "near_duplicates": 0, "chars": 0, "chars_saved": 0}
+
+    def signature(self, tokens: list[str]) -> np.ndarray:
+        n = self.shingle_size
+        shingles = {" ".join(tokens[i:i + n]) for i in range(max(1, len(tokens) - n + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+        # universal hashing (a * x + b) mod p, one column per permutation
+        permuted = (np.outer(hashes, self._a) % _MERSENNE_PRIME + self._b) % _MERSENNE_PRIME & _MAX_HASH
+        return permuted.min(axis=0).astype(np.uint32)
+
+    def _near_duplicate(self, signature: np.ndarray, position: int) -> tuple[int, float] | None:
+        """The stream position of a kept document `signature` nearly duplicates and their estimated similarity, or None (and keep it)."""
+        seen = set()
+        keys = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        for band, key in enumerate(keys):
+            for candidate in self._buckets[band].get(key, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                similarity = float(np.mean(self._signatures[candidate] == signature))
+                if similarity >= self.near_threshold:
+                    return self._positions[candidate], similarity
+
+        doc_id = len(self._signatures)
+        self._signatures.append(signature)
+        self._positions.append(position)
+        for band, key in enumerate(keys):
+            self._buckets[band][key].append(doc_id)
+        return None
+
+    def is_duplicate(self, document: str) -> bool:
+        self.stats["docs"] += 1
+        self.stats["chars"] += len(document)
+        tokens = normalize(document)
+
+        key = hashlib.md5(" ".join(tokens).encode("utf-8")).digest()
+        if key in self._exact:
+            self.stats["exact_duplicates"] += 1
+            self.stats["chars_saved"] += len(document)
+            return True
+        self._exact.add(key)
+
+        position = self.stats["docs"] - 1
+        match = self._near_duplicate(self.signature(tokens), position) if self.near_threshold is not None and tokens else None
+        if match is not None:
+            kept, similarity = match
+            logging.info(f"Dropped document {position} as a near duplicate ({similarity:.2f}) of document {kept}: {document.strip()[:100]!r}")
+            self.stats["near_duplicates"] += 1
+            self.stats["chars_saved"] += len(document)
+            return True
+
+        self.stats["kept"] += 1
+        return False
+
+    def filter(self, documents):
+        for document in documents:
+            if not self.is_duplicate(document):
+                yield document
+
+    def report(self) -> str:
+        s = self.stats
+        saved = s["chars_saved"] / s["chars"] if s["chars"] else 0.0
+        return (
+            f"Dedup: kept {s['kept']} of {s['docs']} docs, dropped {s['exact_duplicates']} exact and "
+            f"{s['near_duplicates']} near duplicates, {s['chars_saved']} chars ({saved:.1%}) not inserted"
+        )
+
+if __name__ == "__main__":
+    from ingest import iter_documents
+
+    parser = argparse.ArgumentParser(description="Report how much of a context file is duplicated")
+    parser.add_argument("-d", "--dataset", default="musique", choices=["hotpotqa", "musique", "2wikimultihopqa"], help="Dataset to use.")
+    parser.add_argument("-t", "--threshold", default=DEDUP_NEAR_THRESHOLD, type=float, help="Jaccard similarity above which passages count as near duplicates.")
+    args = parser.parse_args()
+
+    deduplicator = Deduplicator(near_threshold=args.threshold)
+    for _ in deduplicator.filter(iter_documents(f"./datasets/contexts/{args.dataset}.txt", one_per_line=True)):
+        pass
+    print(deduplicator.report())
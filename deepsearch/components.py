@@ -1,12 +1,16 @@
 import asyncio
 import json
-from deepsearch.prompts import PROMPTS
+import logging
+from deepsearch.layout import build_prompt
 from utils import openai_complete
+from tracing import traced
+from tokens import fit_to_budget
 
+@traced("keywords", record=("query",))
 async def keywords_extraction(query):
     try:
-        keyword_prompt = PROMPTS["keywords_extraction"].format(query=query)
-        keywords_response = await openai_complete(prompt=keyword_prompt)
+        keyword_prompt = build_prompt("keywords_extraction", query=query)
+        keywords_response = await openai_complete(prompt=keyword_prompt, stage="keywords_extraction")
         
         try:
             keywords_data = json.loads(keywords_response)
@@ -19,112 +23,149 @@ async def keywords_extraction(query):
             low_level_keywords = keywords_response.strip()
         
         return high_level_keywords, low_level_keywords
-    except:
+    except Exception:
+        logging.exception("keywords_extraction failed")
         return "", ""
 
+@traced("decomposition", record=("query",))
 async def question_decomposition_deep(query):
     try:
-        decomp_prompt = PROMPTS["query_decomposition_deep"].format(query=query)
-        sub_queries = await openai_complete(prompt=decomp_prompt)
+        decomp_prompt = build_prompt("query_decomposition_deep", query=query)
+        sub_queries = await openai_complete(prompt=decomp_prompt, stage="question_decomposition_deep")
         return sub_queries.strip()
-    except:
+    except Exception:
+        logging.exception("question_decomposition_deep failed")
         return ""
 
+@traced("decomposition", record=("query",))
 async def question_decomposition_deep_kg(query):
     try:
-        decomp_prompt = PROMPTS["query_decomposition_deep_kg"].format(query=query)
-        sub_queries = await openai_complete(prompt=decomp_prompt)
+        decomp_prompt = build_prompt("query_decomposition_deep_kg", query=query)
+        sub_queries = await openai_complete(prompt=decomp_prompt, stage="question_decomposition_deep_kg")
         return sub_queries.strip()
-    except:
+    except Exception:
+        logging.exception("question_decomposition_deep_kg failed")
         return ""
 
+@traced("completion", record=("sub_query",))
 async def query_completer(sub_query, context_data):
     try:
-        completer_prompt = PROMPTS["query_completer"].format(
+        context_data = fit_to_budget(context_data, "query_completer")
+        completer_prompt = build_prompt(
+            "query_completer",
             sub_query=sub_query,
             context_data=context_data
         )
-        completed_query = await openai_complete(prompt=completer_prompt)
+        completed_query = await openai_complete(prompt=completer_prompt, stage="query_completer")
         return completed_query.strip()
-    except:
+    except Exception:
+        logging.exception("query_completer failed")
         return ""
 
+@traced("completion", record=("sub_query",))
 async def kg_query_completer(sub_query, context_data):
     try:
-        completer_prompt = PROMPTS["kg_query_completer"].format(
+        context_data = fit_to_budget(context_data, "kg_query_completer")
+        completer_prompt = build_prompt(
+            "kg_query_completer",
             sub_query=sub_query,
             context_data=context_data
         )
-        completed_query = await openai_complete(prompt=completer_prompt)
+        completed_query = await openai_complete(prompt=completer_prompt, stage="kg_query_completer")
         return completed_query.strip()
-    except:
+    except Exception:
+        logging.exception("kg_query_completer failed")
         return ""
+@traced("summary", record=("query",))
 async def text_summary(query, context_data):
     try:
-        summary_prompt = PROMPTS["retrieval_text_summarization"].format(
+        context_data = fit_to_budget(context_data, "text_summary")
+        summary_prompt = build_prompt(
+            "retrieval_text_summarization",
             query=query,
             context_data=context_data
         )
-        text_summary = await openai_complete(prompt=summary_prompt)
+        text_summary = await openai_complete(prompt=summary_prompt, stage="text_summary")
         return text_summary.strip()
-    except:
+    except Exception:
+        logging.exception("text_summary failed")
         return ""
 
+@traced("summary", record=("query",))
 async def kg_summary(query, context_data):
     try:
-        kg_summary_prompt = PROMPTS["knowledge_graph_summarization"].format(
+        context_data = fit_to_budget(context_data, "kg_summary")
+        kg_summary_prompt = build_prompt(
+            "knowledge_graph_summarization",
             query=query,
             context_data=context_data
         )
-        kg_summary = await openai_complete(prompt=kg_summary_prompt)
+        kg_summary = await openai_complete(prompt=kg_summary_prompt, stage="kg_summary")
         return kg_summary.strip()
-    except:
+    except Exception:
+        logging.exception("kg_summary failed")
         return ""
 
+@traced("answer", record=("query",))
 async def answer_generation(query, context_data):
     try:
-        answer_prompt = PROMPTS["answer_generation"].format(
+        context_data = fit_to_budget(context_data, "answer_generation")
+        answer_prompt = build_prompt(
+            "answer_generation",
             query=query,
             context_data=context_data
         )
-        final_answer = await openai_complete(prompt=answer_prompt)
+        final_answer = await openai_complete(prompt=answer_prompt, stage="answer_generation")
         return final_answer.strip()
-    except:
+    except Exception:
+        logging.exception("answer_generation failed")
         return ""
 
+@traced("answer", record=("query",))
 async def answer_generation_deep(query, context_data):
     try:
-        answer_prompt = PROMPTS["answer_generation_deep"].format(
+        context_data = fit_to_budget(context_data, "answer_generation_deep")
+        answer_prompt = build_prompt(
+            "answer_generation_deep",
             query=query,
             context_data=context_data
         )
-        final_answer = await openai_complete(prompt=answer_prompt)
+        final_answer = await openai_complete(prompt=answer_prompt, stage="answer_generation_deep")
         return final_answer.strip()
-    except:
+    except Exception:
+        logging.exception("answer_generation_deep failed")
         return ""
 
+@traced("verification", record=("query",))
 async def evidence_verification(query, context_data, model_response):
     try:
-        verify_prompt = PROMPTS["evidence_verification"].format(
+        context_data = fit_to_budget(context_data, "evidence_verification")
+        verify_prompt = build_prompt(
+            "evidence_verification",
             query=query,
             context_data=context_data,
             model_response=model_response
         )
-        final_verification = await openai_complete(prompt=verify_prompt)
+        final_verification = await openai_complete(prompt=verify_prompt, stage="evidence_verification")
         return final_verification.strip()
-    except:
+    except Exception:
+        logging.exception("evidence_verification failed")
         return ""
 
+@traced("expansion", record=("query",))
 async def query_expansion(query, context_data, model_response, evidence_verification):
     try:
-        query_expansion_prompt = PROMPTS["query_expansion"].format(
+        context_data = fit_to_budget(context_data, "query_expansion")
+        query_expansion_prompt = build_prompt(
+            "query_expansion",
             query=query,
             context_data=context_data,
             model_response=model_response,
             evidence_verification=evidence_verification
         )
-        expanded_queries = await openai_complete(prompt=query_expansion_prompt)
+        expanded_queries = await openai_complete(prompt=query_expansion_prompt, stage="query_expansion")
         return expanded_queries.strip()
-    except:
+    except Exception:
+        logging.exception("query_expansion failed")
         return ""
 
@@ -0,0 +1,67 @@
+import re
+
+from deepsearch.prompts import PROMPTS
+from config import PROMPT_LAYOUT
+
+LAYOUTS = ("interleaved", "prefix_cache")
+# per prompt, the inputs that repeat across a question's calls, most stable first: the main question
+# where the prompt gets it, then the accumulated retrieval history; the remaining inputs are per call
+STABLE_FIELDS = {
+    "answer_generation_deep": ("query", "context_data"),
+    "evidence_verification": ("query", "context_data"),
+    "query_expansion": ("query", "context_data"),
+    # context_data starts with the decomposition and the sub-query history, the sub-query changes
+    "query_completer": ("context_data",),
+    "kg_query_completer": ("context_data",),
+    # context_data starts with the sub-query history and ends with the new summary
+    "answer_generation": ("context_data",),
+}
+# e.g. the summaries, whose sub-query and retrieved context both change on every call, keep their order
+DEFAULT_STABLE_FIELDS = ()
+
+_LAYOUT = PROMPT_LAYOUT
+
+def set_prompt_layout(layout: str):
+    """Choose how `build_prompt` assembles prompts, "interleaved" (as written in PROMPTS) or "prefix_cache"."""
+    global _LAYOUT
+    if layout not in LAYOUTS:
+        raise ValueError(f"prompt layout must be one of {LAYOUTS}, got {layout!r}")
+    _LAYOUT = layout
+
+def get_prompt_layout() -> str:
+    return _LAYOUT
+
+def split_template(template: str) -> tuple[str, list[tuple[str, str]], str] | None:
+    """
+    Split a prompt template into its static instructions (up to and including
+    the ---Input--- marker), its (label, field) inputs and the trailing
+    ---Output--- section, or None if it has no such input section.
+    """
+    start = template.find("---Input---")
+    end = template.find("---Output---", start)
+    if start < 0 or end < 0:
+        return None
+    static = template[:start + len("---Input---")].format()
+    fields = re.findall(r"^([^\n{}]+?)[ \t]*\n\{(\w+)\}$", template[start:end], flags=re.M)
+    return static, fields, template[end:]
+
+_SPLIT = {name: split_template(template) for name, template in PROMPTS.items()}
+
+def build_prompt(name: str, **fields) -> str:
+    """
+    Fill the PROMPTS template `name`. The "prefix_cache" layout keeps each
+    prompt's static instructions first and moves the inputs that repeat
+    across a question's calls (see STABLE_FIELDS) ahead of the per-call ones
+    (sub-query, retrieved context, model response), so calls that share
+    instructions and history share a byte-identical prefix that the server's
+    prefix cache can reuse.
+    """
+    split = _SPLIT.get(name)
+    if _LAYOUT == "interleaved" or split is None or len(split[1]) < 2:
+        return PROMPTS[name].format(**fields)
+
+    static, inputs, output = split
+    stable = STABLE_FIELDS.get(name, DEFAULT_STABLE_FIELDS)
+    ordered = sorted(inputs, key=lambda item: stable.index(item[1]) if item[1] in stable else len(stable))
+    body = "\n\n".join(f"{label}\n{fields[field]}" for label, field in ordered)
+    return f"{static}\n\n{body}\n\n{output}"
@@ -0,0 +1,295 @@
+import os
+import json
+import asyncio
+import hashlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from config import EMBED_MODEL_NAME, EMBED_MAX_BATCH_SIZE, EMBED_MAX_WAIT, EMBED_CACHE_SIZE, EMBED_DISK_CACHE_PATH
+
+_EMBED_MODEL = None
+_EMBED_MODEL_LOCK = threading.Lock()
+# one encoder thread per process, shared by every event loop
+_EMBED_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="embedding")
+
+def get_embed_model():
+    """Load the SentenceTransformer once per process."""
+    global _EMBED_MODEL
+    if _EMBED_MODEL is None:
+        with _EMBED_MODEL_LOCK:
+            if _EMBED_MODEL is None:
+                from sentence_transformers import SentenceTransformer
+                _EMBED_MODEL = SentenceTransformer(EMBED_MODEL_NAME, trust_remote_code=True)
+    return _EMBED_MODEL
+
+def set_embed_model(model):
+    """Use `model` (anything with SentenceTransformer's `encode`) instead of EMBED_MODEL_NAME, e.g. for offline benchmarks."""
+    global _EMBED_MODEL, _SERVICE, _EMBED_CACHE
+    _EMBED_MODEL = model
+    _SERVICE = None
+    # cache keys do not include the model
+    if _EMBED_CACHE is not None:
+        _EMBED_CACHE.flush()
+    _EMBED_CACHE = None
+
+class DiskEmbeddingStore:
+    """
+    Append-only on-disk embedding store: a memory-mapped float16 matrix
+    (`{path}.f16`) plus a `{path}.idx` file mapping key hashes to rows.
+    Meant for a single writer process.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.dim = None
+        self.capacity = 0
+        self.rows = {}
+        self._matrix = None
+        self._index_file = None
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        if os.path.exists(f"{path}.meta.json"):
+            with open(f"{path}.meta.json", "r") as f:
+                meta = json.load(f)
+            self.dim, self.capacity = meta["dim"], meta["capacity"]
+            self._matrix = np.memmap(f"{path}.f16", dtype=np.float16, mode="r+", shape=(self.capacity, self.dim))
+            with open(f"{path}.idx", "r") as f:
+                for line in f:
+                    try:
+                        key_hash, row = line.rstrip("\n").split("\t")
+                        self.rows[key_hash] = int(row)
+                    except ValueError:
+                        continue
+
+    @staticmethod
+    def _hash(key: str) -> str:
+        return hashlib.md5(key.encode()).hexdigest()
+
+    def get(self, key: str) -> np.ndarray | None:
+        row = self.rows.get(self._hash(key))
+        if row is None:
+            return None
+        return np.asarray(self._matrix[row], dtype=np.float32)
+
+    def _grow(self, min_capacity: int):
+        capacity = max(1024, self.capacity)
+        while capacity < min_capacity:
+            capacity *= 2
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        with open(f"{self.path}.f16", "ab") as f:
+            f.truncate(capacity * self.dim * np.dtype(np.float16).itemsize)
+        self._matrix = np.memmap(f"{self.path}.f16", dtype=np.float16, mode="r+", shape=(capacity, self.dim))
+        self.capacity = capacity
+        with open(f"{self.path}.meta.json", "w") as f:
+            json.dump({"dim": self.dim, "capacity": self.capacity}, f)
+
+    def put(self, key: str, vector: np.ndarray):
+        key_hash = self._hash(key)
+        if key_hash in self.rows:
+            return
+        if self.dim is None:
+            self.dim = int(vector.shape[-1])
+        row = len(self.rows)
+        if row >= self.capacity:
+            self._grow(row + 1)
+        self._matrix[row] = vector.astype(np.float16)
+        if self._index_file is None:
+            self._index_file = open(f"{self.path}.idx", "a")
+        self._index_file.write(f"{key_hash}\t{row}\n")
+        self.rows[key_hash] = row
+
+    def flush(self):
+        if self._matrix is not None:
+            self._matrix.flush()
+        if self._index_file is not None:
+            self._index_file.flush()
+
+class EmbeddingCache:
+    """In-memory LRU of embeddings keyed on whitespace-normalised text, optionally backed by a DiskEmbeddingStore."""
+
+    def __init__(self, max_entries: int = EMBED_CACHE_SIZE, disk_path: str | None = EMBED_DISK_CACHE_PATH):
+        self.max_entries = max_entries
+        self._memory = OrderedDict()
+        self._disk = DiskEmbeddingStore(disk_path) if disk_path else None
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(text: str, normalize_embeddings: bool) -> str:
+        return f"{int(normalize_embeddings)}:{' '.join(text.split())}"
+
+    def get(self, key: str) -> np.ndarray | None:
+        vector = self._memory.get(key)
+        if vector is not None:
+            self._memory.move_to_end(key)
+            self.hits += 1
+            return vector
+        if self._disk is not None:
+            vector = self._disk.get(key)
+            if vector is not None:
+                self.disk_hits += 1
+                self._remember(key, vector)
+                return vector
+        self.misses += 1
+        return None
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if self.max_entries <= 0:
+            return
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+
+    def put(self, key: str, vector: np.ndarray):
+        self._remember(key, vector)
+        if self._disk is not None:
+            self._disk.put(key, vector)
+
+    def flush(self):
+        if self._disk is not None:
+            self._disk.flush()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            "entries": len(self._memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.disk_hits) / lookups if lookups else 0.0,
+        }
+
+_EMBED_CACHE: EmbeddingCache | None = None
+
+def get_embedding_cache() -> EmbeddingCache:
+    global _EMBED_CACHE
+    if _EMBED_CACHE is None:
+        _EMBED_CACHE = EmbeddingCache()
+    return _EMBED_CACHE
+
+def encode_cached(model, texts: list[str], normalize_embeddings: bool = False) -> np.ndarray:
+    """Synchronous `model.encode` that only encodes texts missing from the embedding cache."""
+    cache = get_embedding_cache()
+    keys = [cache.key(text, normalize_embeddings) for text in texts]
+    vectors = [cache.get(key) for key in keys]
+    missing = [i for i, vector in enumerate(vectors) if vector is None]
+    if missing:
+        embeddings = model.encode([texts[i] for i in missing], normalize_embeddings=normalize_embeddings)
+        for j, i in enumerate(missing):
+            vectors[i] = embeddings[j]
+            cache.put(keys[i], embeddings[j])
+    return np.stack(vectors)
+
+class EmbeddingService:
+    """
+    Async front-end to the shared embedding model.
+
+    Texts already in the embedding cache are not re-encoded. The remaining
+    concurrent `encode` calls are coalesced into one `model.encode` call of up
+    to `max_batch_size` texts, waiting at most `max_wait` seconds for a batch
+    to fill. Encoding runs on a single worker thread so the event loop keeps
+    serving other questions meanwhile.
+    """
+
+    def __init__(self, model, max_batch_size: int = EMBED_MAX_BATCH_SIZE, max_wait: float = EMBED_MAX_WAIT):
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._queues = {}  # normalize_embeddings -> pending [(texts, future)]
+        self._flushers = {}
+        self._dispatches = set()
+
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+
+    async def encode(self, texts: list[str], normalize_embeddings: bool = False) -> np.ndarray:
+        if len(texts) == 0:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        self.requests += 1
+
+        cache = get_embedding_cache()
+        keys = [cache.key(text, normalize_embeddings) for text in texts]
+        vectors = [cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(vectors) if vector is None]
+        if missing:
+            embeddings = await self._encode_uncached([texts[i] for i in missing], normalize_embeddings)
+            for j, i in enumerate(missing):
+                vectors[i] = embeddings[j]
+                cache.put(keys[i], embeddings[j])
+        return np.stack(vectors)
+
+    async def _encode_uncached(self, texts: list[str], normalize_embeddings: bool) -> np.ndarray:
+        if len(texts) >= self.max_batch_size:
+            # already a full batch on its own
+            return await self._run_batch(list(texts), normalize_embeddings)
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.setdefault(normalize_embeddings, [])
+        queue.append((list(texts), future))
+        if sum(len(t) for t, _ in queue) >= self.max_batch_size:
+            self._flush(normalize_embeddings)
+        elif normalize_embeddings not in self._flushers:
+            self._flushers[normalize_embeddings] = asyncio.get_running_loop().call_later(
+                self.max_wait, self._flush, normalize_embeddings
+            )
+        return await future
+
+    def _flush(self, normalize_embeddings: bool):
+        handle = self._flushers.pop(normalize_embeddings, None)
+        if handle is not None:
+            handle.cancel()
+        pending = self._queues.pop(normalize_embeddings, [])
+        if pending:
+            task = asyncio.ensure_future(self._dispatch(pending, normalize_embeddings))
+            self._dispatches.add(task)
+            task.add_done_callback(self._dispatches.discard)
+
+    async def _dispatch(self, pending: list, normalize_embeddings: bool):
+        texts = [text for batch, _ in pending for text in batch]
+        try:
+            embeddings = await self._run_batch(texts, normalize_embeddings)
+        except Exception as e:
+            for _, future in pending:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for batch, future in pending:
+            if not future.done():
+                future.set_result(embeddings[offset:offset + len(batch)])
+            offset += len(batch)
+
+    async def _run_batch(self, texts: list[str], normalize_embeddings: bool) -> np.ndarray:
+        self.batches += 1
+        self.texts += len(texts)
+        return await asyncio.get_running_loop().run_in_executor(
+            _EMBED_EXECUTOR,
+            lambda: self.model.encode(texts, normalize_embeddings=normalize_embeddings),
+        )
+
+    def stats(self) -> dict:
+        return {
+            "requests": self.requests,
+            "batches": self.batches,
+            "texts": self.texts,
+            "mean_batch_size": self.texts / self.batches if self.batches else 0.0,
+        }
+
+_SERVICE: tuple[asyncio.AbstractEventLoop, EmbeddingService] | None = None
+
+def get_embedding_service() -> EmbeddingService:
+    """Process-wide embedding service for the running loop; the model itself is shared across loops."""
+    global _SERVICE
+    loop = asyncio.get_running_loop()
+    if _SERVICE is None or _SERVICE[0] is not loop:
+        _SERVICE = (loop, EmbeddingService(get_embed_model()))
+    return _SERVICE[1]
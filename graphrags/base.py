@@ -1,28 +1,222 @@
+import asyncio
 from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import replace
+
+from utils import normalize, compute_args_hash, truncate_str_by_token_size
+from tracing import span, set_span_attributes
+from replay import replayable
+from tokens import count_tokens, get_tokenizer
+from config import RETRIEVAL_CACHE_SIZE
+from .records import StructuredContext, trim_records
+from .seen import SeenRecords
+
+# the record lists each filter_type renders
+FILTER_KINDS = {"semantic": ("chunks",), "relational": ("entities", "relationships")}
 
 class GraphRAGBase(ABC):
-    def __init__(self, grag, QueryParam, grag_mode, top_k):
+    def __init__(self, grag, QueryParam, grag_mode, top_k, retrieval_cache_size=RETRIEVAL_CACHE_SIZE):
         self.grag = grag
         self.QueryParam = QueryParam
         self.grag_mode = grag_mode
         self.top_k = top_k
+        # per-question memo (see retrieval_scope) and optional cross-question LRU
+        self.retrieval_cache_size = retrieval_cache_size
+        self._retrieval_cache = OrderedDict()
+        self._retrieval_memo = ContextVar(f"retrieval_memo_{id(self)}", default=None)
+        self._seen_records = ContextVar(f"seen_records_{id(self)}", default=None)
 
     @abstractmethod
     def init_graphrag(self, working_dir: str, EMBED_MODEL):
         pass
 
     @abstractmethod
-    def context_filter(self, context_data: str, filter_type: str) -> str:
+    def parse_context(self, context_data: str) -> StructuredContext:
+        """Split the backend's rendered context string into records."""
         pass
 
+    @abstractmethod
+    def render_context(self, context: StructuredContext, filter_type: str) -> str:
+        """Render records back in the backend's format, keeping only the
+        chunks ("semantic") or the entities and relationships ("relational")."""
+        pass
+
+    def context_filter(self, context_data: str, filter_type: str) -> str:
+        context = self.parse_context(context_data)
+        if context.is_empty():
+            return ""
+        return self.render_context(context, filter_type)
+
+    @contextmanager
+    def retrieval_scope(self):
+        """Retrieve each distinct (normalised) query at most once inside this block."""
+        token = self._retrieval_memo.set({})
+        try:
+            yield
+        finally:
+            self._retrieval_memo.reset(token)
+
+    @contextmanager
+    def seen_context_scope(self):
+        """Track the records sent to the LLM inside this block, so steps can skip what earlier ones summarized."""
+        seen = SeenRecords()
+        token = self._seen_records.set(seen)
+        try:
+            yield seen
+        finally:
+            self._seen_records.reset(token)
+
+    def summaries_relied_on(self) -> set[str]:
+        """Steps whose summaries later steps rely on for records they skipped; empty outside a `seen_context_scope`."""
+        seen = self._seen_records.get()
+        return seen.relied_on if seen is not None else set()
+
+    async def _memoized(self, kind: str, question: str, fetch):
+        with span("retrieval", "retrieval", query=question[:200], source=kind):
+            return await self._memoized_fetch(kind, question, fetch)
+
+    @staticmethod
+    def _memo_query(question: str) -> str:
+        return " ".join(normalize(question)) or question
+
+    async def _memoized_fetch(self, kind: str, question: str, fetch):
+        key = (kind, self._memo_query(question))
+        if key in self._retrieval_cache:
+            self._retrieval_cache.move_to_end(key)
+            set_span_attributes(cache="lru")
+            return self._retrieval_cache[key]
+
+        memo = self._retrieval_memo.get()
+        if memo is None:
+            set_span_attributes(cache="miss")
+            result = await self._fetch(kind, question, fetch)
+        else:
+            # share in-flight retrievals too, so concurrent channels do not race on the same query
+            set_span_attributes(cache="memo" if key in memo else "miss")
+            if key not in memo:
+                memo[key] = asyncio.ensure_future(self._fetch(kind, question, fetch))
+            result = await asyncio.shield(memo[key])
+
+        if self.retrieval_cache_size > 0:
+            self._retrieval_cache[key] = result
+            self._retrieval_cache.move_to_end(key)
+            while len(self._retrieval_cache) > self.retrieval_cache_size:
+                self._retrieval_cache.popitem(last=False)
+        return result
+
+    async def _fetch(self, kind: str, question: str, fetch):
+        """Run a backend retrieval through the active recorder or replayer (see replay.py)."""
+        # keyed like the memo, so whichever spelling of a query is fetched first, a replay finds it
+        key = compute_args_hash(type(self).__name__, self.grag_mode, self.top_k, self._memo_query(question), cache_type=kind)
+        if kind == "data":
+            return await replayable(kind, key, lambda: fetch(question), encode=StructuredContext.to_dict, decode=StructuredContext.from_dict)
+        return await replayable(kind, key, lambda: fetch(question))
+
     async def aquery_context(self, question: str):
+        return await self._memoized("context", question, self._aquery_context)
+
+    async def _aquery_context(self, question: str):
         return await self.grag.aquery(
             question,
             self.QueryParam(mode=self.grag_mode, only_need_context=True, top_k=self.top_k)
         )
+
+    async def aquery_context_structured(self, question: str) -> StructuredContext:
+        # backends without a structured retrieval API parse their rendered context once
+        return self.parse_context(await self.aquery_context(question))
+
+    async def aquery_filtered_context(self, question: str, filter_type: str, max_tokens: int | None = None, step: str | None = None, after: list[str] | None = None) -> str:
+        """
+        Retrieve and render the `filter_type` records for `question`. Inside a
+        `seen_context_scope`, records that a step in `after` (any step if None)
+        already sent are left out, and the records rendered are claimed for `step`.
+        """
+        context = await self.aquery_context_structured(question)
+        if context.is_empty():
+            return ""
+        with span("filter", "filter", filter_type=filter_type):
+            seen = self._seen_records.get()
+            skipped = 0
+            if seen is not None and step is not None:
+                context, skipped = seen.filter(context, step, after, FILTER_KINDS[filter_type])
+                set_span_attributes(records_skipped=skipped)
+            if max_tokens is not None:
+                context = self.trim_context(context, question, max_tokens, filter_type)
+            rendered = self.render_context(context, filter_type)
+            # claimed only once trimmed, so records cut for the budget are not taken as summarized
+            if seen is not None and step is not None:
+                seen.claim(context, step, FILTER_KINDS[filter_type])
+            if skipped:
+                rendered = (rendered + "\n" if any(getattr(context, kind) for kind in FILTER_KINDS[filter_type]) else "") + f"({skipped} more records were already summarized in earlier steps.)"
+            return rendered
+
+    async def aquery_context_within(self, question: str, max_tokens: int | None, step: str | None = None) -> str:
+        """
+        The full context for `question`, re-rendered from its most relevant
+        records if it exceeds `max_tokens`. Inside a `seen_context_scope` the
+        records it keeps are claimed for `step`.
+        """
+        context_data = await self.aquery_context(question)
+        seen = self._seen_records.get()
+        fits = max_tokens is None or count_tokens(context_data) <= max_tokens
+        if fits and (seen is None or step is None):
+            return context_data
+        context = self.parse_context(context_data)
+        if fits:
+            seen.claim(context, step)
+            return context_data
+        if context.is_empty():
+            return truncate_str_by_token_size(context_data, max_tokens, get_tokenizer())
+        context = self.trim_context(context, question, max_tokens)
+        if seen is not None and step is not None:
+            seen.claim(context, step)
+        return self._render_filters(context)
+
+    def _render_filters(self, context: StructuredContext, filter_type: str | None = None) -> str:
+        if filter_type is not None:
+            return self.render_context(context, filter_type)
+        return self.render_context(context, "relational") + "\n" + self.render_context(context, "semantic")
+
+    def trim_context(self, context: StructuredContext, question: str, max_tokens: int, filter_type: str | None = None) -> StructuredContext:
+        """The records of `context` (both filters if `filter_type` is None) most relevant to `question` whose rendering fits in `max_tokens`."""
+        kinds = FILTER_KINDS.get(filter_type, ("entities", "relationships", "chunks"))
+        # section headers, fences and references are paid for whatever records are kept
+        overhead = count_tokens(self._render_filters(replace(context, entities=[], relationships=[], chunks=[]), filter_type))
+        return trim_records(context, question, max(max_tokens - overhead, 0), kinds)
     
     async def aquery_answer(self, question: str):
         return await self.grag.aquery(
             question,
             self.QueryParam(mode=self.grag_mode, only_need_context=False, top_k=self.top_k)
-        )
\ No newline at end of file
+        )
+
+    async def ainsert(self, documents: list[str]):
+        return await self.grag.ainsert(documents)
+
+    async def processed_documents(self, hashes: list[str]) -> set[str]:
+        """
+        Of the documents with these content hashes (md5 of the stripped text),
+        the ones the backend has finished processing. Backends that track
+        document status (LightRAG's `doc_status`) may return from `ainsert`
+        with documents only queued; the others process them before returning.
+        """
+        doc_status = getattr(self.grag, "doc_status", None)
+        if doc_status is None:
+            return set(hashes)
+        statuses = await doc_status.get_by_ids([f"doc-{h}" for h in hashes])
+        processed = set()
+        for h, status in zip(hashes, statuses):
+            if isinstance(status, dict):
+                status = status.get("status")
+            else:
+                status = getattr(status, "status", None)
+            if getattr(status, "value", status) == "processed":
+                processed.add(h)
+        return processed
+
+    def count_chunks(self) -> int | None:
+        """Chunks currently stored, or None if the backend's chunk storage cannot be counted cheaply."""
+        data = getattr(getattr(self.grag, "text_chunks", None), "_data", None)
+        return len(data) if data is not None else None
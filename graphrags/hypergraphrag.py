@@ -1,4 +1,3 @@
-import re
 import numpy as np
 
 from HyperGraphRAG.hypergraphrag import HyperGraphRAG, QueryParam
@@ -6,13 +5,17 @@ from HyperGraphRAG.hypergraphrag.llm import openai_complete_if_cache, GPTKeyword
 from HyperGraphRAG.hypergraphrag.utils import logging, wrap_embedding_func_with_attrs
 
 from .base import GraphRAGBase
+from .records import StructuredContext, parse_csv_sections, render_csv_block
+from llm.backend import backend_llm_func
+from embedding import get_embedding_service
 
-from config import (
-    MODEL_NAME,
-    LLM_BASE_URL,
-    LLM_API_KEY,
-    GRAG_MODE
-)
+from config import GRAG_MODE
+
+CONTEXT_SECTIONS = {
+    "entities": ("-----Entities-----", "entity"),
+    "relationships": ("-----Relationships-----", "relationship"),
+    "sources": ("-----Sources-----", "chunk"),
+}
 
 class HyperGraphRAGMethod(GraphRAGBase):
     def __init__(self, working_dir: str, EMBED_MODEL, top_k: int):
@@ -28,24 +31,9 @@ class HyperGraphRAGMethod(GraphRAGBase):
             max_token_size=EMBED_MODEL.max_seq_length,
         )
         async def embedding_func(texts: list[str]) -> np.ndarray:
-            return EMBED_MODEL.encode(texts, normalize_embeddings=True)
+            return await get_embedding_service().encode(texts, normalize_embeddings=True)
 
-        async def qwen_complete(
-            prompt,
-            system_prompt="",
-            history_messages=[],
-            keyword_extraction=False,
-            **kwargs,
-        ) -> str:
-            return await openai_complete_if_cache(
-                model=MODEL_NAME,
-                prompt=prompt,
-                system_prompt=system_prompt,
-                history_messages=history_messages,
-                base_url=LLM_BASE_URL,
-                api_key=LLM_API_KEY,
-                **kwargs,
-            )
+        qwen_complete = backend_llm_func(openai_complete_if_cache)
 
         grag = HyperGraphRAG(
             working_dir=working_dir,
@@ -59,33 +47,27 @@ class HyperGraphRAGMethod(GraphRAGBase):
         
         return grag
     
-    def context_filter(self, context_data: str, filter_type: str) -> str:
-        pattern = (
-            r"-----Entities-----\s+```csv\n(.*?)\n```.*?"
-            r"-----Relationships-----\s+```csv\n(.*?)\n```.*?"
-            r"-----Sources-----\s+```csv\n(.*?)\n```"
-        )
-        match = re.search(pattern, context_data, re.DOTALL)
+    def parse_context(self, context_data: str) -> StructuredContext:
+        return parse_csv_sections(context_data, CONTEXT_SECTIONS)
 
-        if not match:
-            return ""
+    def render_context(self, context: StructuredContext, filter_type: str) -> str:
+        def section(name):
+            return render_csv_block(context.headers.get(name, ""), context.section_records(name))
 
-        entities, relationships, sources = match.groups()
-        
         if filter_type == "semantic":
             return f"""-----Sources-----
 ```csv
-{sources}
+{section("sources")}
 ````
 """
 
         elif filter_type == "relational":
             return f"""-----Entities-----
 ```csv
-{entities}
+{section("entities")}
 ```
 -----Relationships-----
 ```csv
-{relationships}
+{section("relationships")}
 ```
 """
\ No newline at end of file
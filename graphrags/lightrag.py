@@ -1,4 +1,4 @@
-import re
+import json
 import asyncio
 import numpy as np
 
@@ -9,13 +9,11 @@ from lightrag.kg.shared_storage import initialize_pipeline_status
 from lightrag.utils import logging, wrap_embedding_func_with_attrs
 
 from .base import GraphRAGBase
+from .records import StructuredContext, extract_fenced_block, parse_json_lines, entity_from_row, relationship_from_row, chunk_from_row
+from llm.backend import backend_llm_func
+from embedding import get_embedding_service
 
-from config import (
-    MODEL_NAME,
-    LLM_BASE_URL,
-    LLM_API_KEY,
-    GRAG_MODE
-)
+from config import GRAG_MODE
 
 class LightRAGMethod(GraphRAGBase):
     def __init__(self, working_dir: str, EMBED_MODEL, top_k: int):
@@ -30,24 +28,9 @@ class LightRAGMethod(GraphRAGBase):
             max_token_size=EMBED_MODEL.max_seq_length,
         )
         async def embedding_func(texts: list[str]) -> np.ndarray:
-            return EMBED_MODEL.encode(texts, normalize_embeddings=True)
-
-        async def qwen_complete(
-            prompt,
-            system_prompt="",
-            history_messages=[],
-            keyword_extraction=False,
-            **kwargs,
-        ) -> str:
-            return await openai_complete_if_cache(
-                model=MODEL_NAME,
-                prompt=prompt,
-                system_prompt=system_prompt,
-                history_messages=history_messages,
-                base_url=LLM_BASE_URL,
-                api_key=LLM_API_KEY,
-                **kwargs,
-            )
+            return await get_embedding_service().encode(texts, normalize_embeddings=True)
+
+        qwen_complete = backend_llm_func(openai_complete_if_cache)
 
         grag = LightRAG(
             working_dir=working_dir,
@@ -66,19 +49,50 @@ class LightRAGMethod(GraphRAGBase):
         
         return grag
 
-    def context_filter(self, context_data: str, filter_type: str) -> str:
-        pattern = (
-            r"Knowledge Graph Data \(Entity\):\s*```json\s*(.*?)\s*```.*?"
-            r"Knowledge Graph Data \(Relationship\):\s*```json\s*(.*?)\s*```.*?"
-            r"Document Chunks.*?```json\s*(.*?)\s*```.*?"
-            r"Reference Document List.*?```(?:json|text)?\s*(.*?)\s*```"
-        )
-
-        match = re.search(pattern, context_data, re.DOTALL)
-        if not match:
-            return ""
+    async def aquery_context_structured(self, question: str) -> StructuredContext:
+        if not hasattr(self.grag, "aquery_data"):
+            return await super().aquery_context_structured(question)
+        return await self._memoized("data", question, self._aquery_data)
 
-        entities_str, relations_str, text_chunks_str, reference_list_str = match.groups()
+    async def _aquery_data(self, question: str) -> StructuredContext:
+        result = await self.grag.aquery_data(
+            question,
+            self.QueryParam(mode=self.grag_mode, top_k=self.top_k)
+        )
+        data = (result or {}).get("data") or {}
+
+        context = StructuredContext()
+        for entity in data.get("entities", []):
+            row = {"entity": entity.get("entity_name", ""), "type": entity.get("entity_type", ""), "description": entity.get("description", "")}
+            context.entities.append(entity_from_row(row, json.dumps(row, ensure_ascii=False)))
+        for relation in data.get("relationships", []):
+            row = {"entity1": relation.get("src_id", ""), "entity2": relation.get("tgt_id", ""), "description": relation.get("description", "")}
+            record = relationship_from_row(row, json.dumps(row, ensure_ascii=False))
+            record.keywords = relation.get("keywords", "")
+            record.weight = relation.get("weight")
+            context.relationships.append(record)
+        for chunk in data.get("chunks", []):
+            row = {"reference_id": chunk.get("reference_id", ""), "content": chunk.get("content", "")}
+            record = chunk_from_row(row, json.dumps(row, ensure_ascii=False))
+            record.file_path = chunk.get("file_path", "")
+            context.chunks.append(record)
+        context.references = [f"[{ref.get('reference_id', '')}] {ref.get('file_path', '')}" for ref in data.get("references", [])]
+        return context
+
+    def parse_context(self, context_data: str) -> StructuredContext:
+        context = StructuredContext()
+        context.entities = [entity_from_row(row, raw) for row, raw in parse_json_lines(extract_fenced_block(context_data, "Knowledge Graph Data (Entity):"))]
+        context.relationships = [relationship_from_row(row, raw) for row, raw in parse_json_lines(extract_fenced_block(context_data, "Knowledge Graph Data (Relationship):"))]
+        context.chunks = [chunk_from_row(row, raw) for row, raw in parse_json_lines(extract_fenced_block(context_data, "Document Chunks"))]
+        reference_list = extract_fenced_block(context_data, "\nReference Document List") or ""
+        context.references = [line for line in reference_list.split("\n") if line.strip()]
+        return context
+
+    def render_context(self, context: StructuredContext, filter_type: str) -> str:
+        entities_str = "\n".join(r.raw for r in context.entities)
+        relations_str = "\n".join(r.raw for r in context.relationships)
+        text_chunks_str = "\n".join(r.raw for r in context.chunks)
+        reference_list_str = "\n".join(context.references)
 
         if filter_type == "semantic":
             return f"""Document Chunks (Each entry has a reference_id refer to the `Reference Document List`):
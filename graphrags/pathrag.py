@@ -1,18 +1,23 @@
-import re
 import numpy as np
 
 from PathRAG.PathRAG import PathRAG, QueryParam
 from PathRAG.PathRAG.llm import openai_complete_if_cache, GPTKeywordExtractionFormat
 from PathRAG.PathRAG.utils import logging, wrap_embedding_func_with_attrs
 
-from config import (
-    MODEL_NAME,
-    LLM_BASE_URL,
-    LLM_API_KEY,
-    GRAG_MODE
-)
+from config import GRAG_MODE
 
 from .base import GraphRAGBase
+from .records import StructuredContext, parse_csv_sections, render_csv_block
+from llm.backend import backend_llm_func
+from embedding import get_embedding_service
+
+CONTEXT_SECTIONS = {
+    "hl_entities": ("-----high-level entity information-----", "entity"),
+    "hl_relations": ("-----high-level relationship information-----", "relationship"),
+    "sources": ("-----Sources-----", "chunk"),
+    "ll_entities": ("-----low-level entity information-----", "entity"),
+    "ll_relations": ("-----low-level relationship information-----", "relationship"),
+}
 
 class PathRAGMethod(GraphRAGBase):
     def __init__(self, working_dir: str, EMBED_MODEL, top_k: int):
@@ -27,24 +32,9 @@ class PathRAGMethod(GraphRAGBase):
             max_token_size=EMBED_MODEL.max_seq_length,
         )
         async def embedding_func(texts: list[str]) -> np.ndarray:
-            return EMBED_MODEL.encode(texts, normalize_embeddings=True)
+            return await get_embedding_service().encode(texts, normalize_embeddings=True)
 
-        async def qwen_complete(
-            prompt,
-            system_prompt="",
-            history_messages=[],
-            keyword_extraction=False,
-            **kwargs,
-        ) -> str:
-            return await openai_complete_if_cache(
-                model=MODEL_NAME,
-                prompt=prompt,
-                system_prompt=system_prompt,
-                history_messages=history_messages,
-                base_url=LLM_BASE_URL,
-                api_key=LLM_API_KEY,
-                **kwargs,
-            )
+        qwen_complete = backend_llm_func(openai_complete_if_cache)
 
         grag = PathRAG(
             working_dir=working_dir,
@@ -58,27 +48,17 @@ class PathRAGMethod(GraphRAGBase):
         
         return grag
     
-    def context_filter(self, context_data: str, filter_type: str) -> str:
-        pattern = (
-            r"-----global-information-----.*?"
-            r"-----high-level entity information-----\s+```csv\n(.*?)\n```.*?"
-            r"-----high-level relationship information-----\s+```csv\n(.*?)\n```.*?"
-            r"-----Sources-----\s+```csv\n(.*?)\n```.*?"
-            r"-----local-information-----.*?"
-            r"-----low-level entity information-----\s+```csv\n(.*?)\n```.*?"
-            r"-----low-level relationship information-----\s+```csv\n(.*?)\n```"
-        )
-        match = re.search(pattern, context_data, re.DOTALL)
+    def parse_context(self, context_data: str) -> StructuredContext:
+        return parse_csv_sections(context_data, CONTEXT_SECTIONS)
 
-        try:
-            hl_entities, hl_relations, sources, ll_entities, ll_relations = match.groups()
-        except:
-            return ""
+    def render_context(self, context: StructuredContext, filter_type: str) -> str:
+        def section(name):
+            return render_csv_block(context.headers.get(name, ""), context.section_records(name))
 
         if filter_type == "semantic":
             return f"""-----Sources-----
 ```csv
-{sources}
+{section("sources")}
 ````
 """
 
@@ -86,19 +66,19 @@ class PathRAGMethod(GraphRAGBase):
             return f"""-----global-information-----
 -----high-level entity information-----
 ```csv
-{hl_entities}
+{section("hl_entities")}
 ```
 -----high-level relationship information-----
 ```csv
-{hl_relations}
+{section("hl_relations")}
 ```
 -----local-information-----
 -----low-level entity information-----
 ```csv
-{ll_entities}
+{section("ll_entities")}
 ```
 -----low-level relationship information-----
 ```csv
-{ll_relations}
+{section("ll_relations")}
 ```
 """
\ No newline at end of file
@@ -0,0 +1,253 @@
+import re
+import csv
+import io
+import json
+import hashlib
+from dataclasses import dataclass, field, asdict, replace
+
+from utils import normalize
+from tokens import count_tokens
+
+@dataclass
+class EntityRecord:
+    name: str
+    type: str = ""
+    description: str = ""
+    section: str = "entities"
+    raw: str = ""
+    fields: dict = field(default_factory=dict)
+
+    @property
+    def key(self):
+        return ("entity", self.name.strip().lower())
+
+@dataclass
+class RelationshipRecord:
+    source: str
+    target: str
+    description: str = ""
+    keywords: str = ""
+    weight: float | None = None
+    section: str = "relationships"
+    raw: str = ""
+    fields: dict = field(default_factory=dict)
+
+    @property
+    def key(self):
+        return ("relationship", self.source.strip().lower(), self.target.strip().lower(), self.description.strip())
+
+@dataclass
+class ChunkRecord:
+    content: str
+    reference_id: str = ""
+    file_path: str = ""
+    section: str = "chunks"
+    raw: str = ""
+    fields: dict = field(default_factory=dict)
+
+    @property
+    def key(self):
+        # a row without a content column is told apart by its whole line
+        return ("chunk", hashlib.md5((self.content.strip() or self.raw).encode()).hexdigest())
+
+@dataclass
+class StructuredContext:
+    """Entity/relationship/chunk records retrieved for one query, plus the
+    per-section CSV headers and reference list needed to render them back in
+    the backend's own format."""
+    entities: list[EntityRecord] = field(default_factory=list)
+    relationships: list[RelationshipRecord] = field(default_factory=list)
+    chunks: list[ChunkRecord] = field(default_factory=list)
+    references: list[str] = field(default_factory=list)
+    headers: dict[str, str] = field(default_factory=dict)
+
+    def is_empty(self) -> bool:
+        return not (self.entities or self.relationships or self.chunks)
+
+    def section_records(self, section: str) -> list:
+        return [r for r in self.entities + self.relationships + self.chunks if r.section == section]
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "StructuredContext":
+        return cls(
+            entities=[EntityRecord(**r) for r in data.get("entities", [])],
+            relationships=[RelationshipRecord(**r) for r in data.get("relationships", [])],
+            chunks=[ChunkRecord(**r) for r in data.get("chunks", [])],
+            references=list(data.get("references", [])),
+            headers=dict(data.get("headers", {})),
+        )
+
+def trim_records(context: StructuredContext, query: str, max_tokens: int, kinds: tuple = ("entities", "relationships", "chunks")) -> StructuredContext:
+    """
+    Keep the records of `kinds` most relevant to `query` whose raw lines fit
+    in `max_tokens`. Records are ranked by how many query terms they contain,
+    ties keeping the backend's order, and the kinds take turns so none crowds
+    out the others. Kept records stay in the backend's order.
+    """
+    terms = set(normalize(query))
+    ranked = {
+        kind: sorted(getattr(context, kind), key=lambda r: -len(terms & set(normalize(r.raw))))
+        for kind in kinds
+    }
+    kept = set()
+    remaining = max_tokens
+    while any(ranked.values()):
+        for kind in kinds:
+            if not ranked[kind]:
+                continue
+            record = ranked[kind].pop(0)
+            # +1 for the line break joining it to the previous record
+            cost = count_tokens(record.raw) + 1
+            if cost <= remaining:
+                kept.add(id(record))
+                remaining -= cost
+    return replace(
+        context,
+        **{kind: [r for r in getattr(context, kind) if id(r) in kept] if kind in kinds else [] for kind in ("entities", "relationships", "chunks")},
+    )
+
+def extract_fenced_block(text: str, marker: str) -> str | None:
+    """Return the body of the first ``` fenced block following `marker`, or None."""
+    start = text.find(marker)
+    if start < 0:
+        return None
+    fence = text.find("```", start + len(marker))
+    if fence < 0:
+        return None
+    body_start = text.find("\n", fence)
+    if body_start < 0:
+        return None
+    body_end = text.find("```", body_start + 1)
+    if body_end < 0:
+        return None
+    return text[body_start + 1:body_end].strip("\n")
+
+def parse_csv_block(block: str) -> tuple[str, list[tuple[dict, str]]]:
+    """
+    Split a backend CSV block into its header line and (row dict, raw line) pairs.
+    Handles both the naive ",\t"-joined tables and properly quoted CSV.
+    """
+    if not block.strip():
+        return "", []
+    header_line, _, body = block.partition("\n")
+
+    if ",\t" in header_line:
+        columns = [c.strip() for c in header_line.split(",\t")]
+        rows = []
+        pending = []
+
+        def flush():
+            if pending:
+                raw = "\n".join(pending)
+                values = raw.split(",\t", len(columns) - 1)
+                rows.append((dict(zip(columns, [v.strip() for v in values])), raw))
+                pending.clear()
+
+        numbered = columns[0] == "id"
+        for line in body.split("\n"):
+            if not line.strip():
+                continue
+            # a field may span several lines: a numbered row runs until the next "<id>,\t" line,
+            # any other row is complete once it has all its separators
+            if numbered:
+                if re.match(r"\d+,\t", line):
+                    flush()
+                pending.append(line)
+                continue
+            pending.append(line)
+            if "\n".join(pending).count(",\t") >= len(columns) - 1:
+                flush()
+        flush()
+        return header_line, rows
+
+    reader = csv.reader(io.StringIO(block), skipinitialspace=True)
+    columns = [c.strip() for c in next(reader)]
+    rows = []
+    for values in reader:
+        if not values:
+            continue
+        out = io.StringIO()
+        csv.writer(out, lineterminator="").writerow(values)
+        rows.append((dict(zip(columns, [v.strip() for v in values])), out.getvalue()))
+    return header_line, rows
+
+def render_csv_block(header: str, records: list) -> str:
+    return "\n".join([header] + [r.raw for r in records])
+
+def _first(row: dict, *names, default=""):
+    for name in names:
+        if row.get(name):
+            return row[name]
+    return default
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+def entity_from_row(row: dict, raw: str, section: str = "entities") -> EntityRecord:
+    return EntityRecord(
+        name=_first(row, "entity", "entity_name", "name", "id"),
+        type=_first(row, "type", "entity_type"),
+        description=_first(row, "description"),
+        section=section,
+        raw=raw,
+        fields=row,
+    )
+
+def relationship_from_row(row: dict, raw: str, section: str = "relationships") -> RelationshipRecord:
+    return RelationshipRecord(
+        source=_first(row, "source", "src_id", "entity1", "hyperedge"),
+        target=_first(row, "target", "tgt_id", "entity2"),
+        description=_first(row, "description"),
+        keywords=_first(row, "keywords"),
+        weight=_to_float(row.get("weight")),
+        section=section,
+        raw=raw,
+        fields=row,
+    )
+
+def chunk_from_row(row: dict, raw: str, section: str = "chunks") -> ChunkRecord:
+    return ChunkRecord(
+        content=_first(row, "content", "text"),
+        reference_id=str(_first(row, "reference_id")),
+        file_path=_first(row, "file_path"),
+        section=section,
+        raw=raw,
+        fields=row,
+    )
+
+def parse_csv_sections(context_data: str, sections: dict[str, tuple[str, str]]) -> StructuredContext:
+    """
+    Parse the CSV sections of a backend context string.
+    `sections` maps a section name to (marker text, record kind), where the kind
+    is one of "entity", "relationship" or "chunk". Missing sections are skipped.
+    """
+    builders = {"entity": entity_from_row, "relationship": relationship_from_row, "chunk": chunk_from_row}
+    targets = {"entity": "entities", "relationship": "relationships", "chunk": "chunks"}
+
+    structured = StructuredContext()
+    for section, (marker, kind) in sections.items():
+        block = extract_fenced_block(context_data, marker)
+        if block is None:
+            continue
+        header, rows = parse_csv_block(block)
+        structured.headers[section] = header
+        getattr(structured, targets[kind]).extend(builders[kind](row, raw, section) for row, raw in rows)
+    return structured
+
+def parse_json_lines(block: str | None) -> list[tuple[dict, str]]:
+    rows = []
+    for line in (block or "").split("\n"):
+        if not line.strip():
+            continue
+        try:
+            row = json.loads(line)
+        except json.JSONDecodeError:
+            row = {"description": line}
+        rows.append((row if isinstance(row, dict) else {"description": line}, line))
+    return rows
@@ -0,0 +1,69 @@
+from collections import defaultdict
+from dataclasses import replace
+
+from tokens import count_tokens
+from .records import StructuredContext
+
+_STATS = defaultdict(int)
+
+def context_dedup_stats() -> dict:
+    """Records sent and skipped, and the context tokens saved, over every question so far."""
+    return dict(_STATS)
+
+class SeenRecords:
+    """
+    Entity, relationship and chunk records already sent to the LLM while
+    answering one question, with every step (e.g. "text:2") that sent them.
+    A record is only skipped for steps that will see one of those steps'
+    summaries, so no sub-query loses evidence it cannot find elsewhere; the
+    steps relied on this way are collected in `relied_on`, and their
+    summaries must stay in the histories rendered after them.
+    """
+
+    def __init__(self):
+        self.steps = defaultdict(set)
+        self.relied_on = set()
+        self.records_sent = 0
+        self.records_skipped = 0
+        self.tokens_saved = 0
+
+    def claim(self, context: StructuredContext, step: str, kinds: tuple = ("entities", "relationships", "chunks")):
+        """Record that `step` sent the records of `kinds` in `context` to the LLM."""
+        sent = 0
+        for kind in kinds:
+            for record in getattr(context, kind):
+                self.steps[record.key].add(step)
+                sent += 1
+        self.records_sent += sent
+        _STATS["records_sent"] += sent
+
+    def filter(self, context: StructuredContext, step: str, after: list[str] | None = None, kinds: tuple = ("entities", "relationships", "chunks")) -> tuple[StructuredContext, int]:
+        """
+        Drop the records of `kinds` that a step in `after` (any step if None)
+        already sent and return the remaining context with the number of
+        records dropped. The caller claims whichever of the remaining records
+        it actually sends.
+        """
+        visible = None if after is None else set(after)
+        kept = {kind: [] for kind in kinds}
+        skipped = 0
+        for kind in kinds:
+            for record in getattr(context, kind):
+                # the record may also have been sent by steps `step` will not see, e.g. the first retrieval
+                senders = self.steps.get(record.key, set()) - {step}
+                covering = senders if visible is None else senders & visible
+                if covering:
+                    self.relied_on.update(covering)
+                    skipped += 1
+                    # +1 for the line break joining it to the previous record
+                    saved = count_tokens(record.raw) + 1
+                    self.tokens_saved += saved
+                    _STATS["tokens_saved"] += saved
+                    continue
+                kept[kind].append(record)
+        self.records_skipped += skipped
+        _STATS["records_skipped"] += skipped
+        return replace(context, **kept), skipped
+
+    def stats(self) -> dict:
+        return {"records_sent": self.records_sent, "records_skipped": self.records_skipped, "tokens_saved": self.tokens_saved}
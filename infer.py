@@ -1,9 +1,53 @@
 import argparse
 import asyncio
+import logging
 from dotenv import load_dotenv
 
 from pipeline import initialize_grag, naive_grag_reasoning, graph_search_reasoning, vanilla_llm_reasoning, naive_rag_reasoning
-from utils import load_vdb
+from utils import load_vdb, vdb_retrieve_batch
+from vdb import open_corpus
+from runner import load_questions, run_batch
+from llm.client import close_openai_clients
+from llm.cache import get_llm_cache
+from llm.limiter import set_llm_concurrency, get_llm_limiter
+from llm.retry import retry_stats
+from graphrags.seen import context_dedup_stats
+from llm.prefix import prefix_stats
+from deepsearch.layout import LAYOUTS, set_prompt_layout
+from llm.endpoints import set_llm_endpoints, get_endpoint_pool
+from embedding import get_embedding_cache
+from tracing import enable_tracing, get_tracer
+from replay import enable_recording, enable_replay, get_recorder, get_replayer
+from config import LLM_MAX_CONCURRENCY, LLM_BASE_URLS, PROMPT_LAYOUT
+
+async def run_reasoning(reasoning, trace_path=None):
+    try:
+        return await reasoning
+    finally:
+        tracer = get_tracer()
+        if tracer is not None and trace_path is not None:
+            tracer.export(trace_path)
+            logging.info(f"Trace written to {trace_path}: {tracer.summary()}")
+        await close_openai_clients()
+        recorder = get_recorder()
+        if recorder is not None:
+            recorder.close()
+            logging.info(f"Recorded calls to {recorder.path}: {recorder.stats()}")
+        replayer = get_replayer()
+        if replayer is not None:
+            logging.info(f"Replay: {replayer.stats()}")
+        llm_cache = get_llm_cache()
+        if llm_cache is not None:
+            llm_cache.flush()
+            logging.info(f"LLM cache: {llm_cache.stats()}")
+        logging.info(f"LLM limiter: {get_llm_limiter().stats()}")
+        logging.info(f"LLM retries per stage: {retry_stats()}")
+        logging.info(f"Context dedup: {context_dedup_stats()}")
+        logging.info(f"Prompt prefix sharing: {prefix_stats()}")
+        logging.info(f"LLM endpoints: {get_endpoint_pool().stats()}")
+        embedding_cache = get_embedding_cache()
+        embedding_cache.flush()
+        logging.info(f"Embedding cache: {embedding_cache.stats()}")
 
 if __name__ == "__main__":
     load_dotenv()
@@ -13,23 +57,53 @@ if __name__ == "__main__":
     parser.add_argument("-m", "--method", default="graphsearch", choices=["graphsearch", "grag", "vanillallm", "naiverag"], help="Reasoning method.")
     parser.add_argument("-g", "--graphrag", default="lightrag", choices=["lightrag", "minirag", "nano", "pathrag", "hipporag", "hypergraphrag"], help="GraphRAG to use.")
     parser.add_argument("-k", "--top_k", default="5", type=int, help="top retrieved items.")
+    parser.add_argument("-q", "--question", default=None, help="Answer a single question instead of the whole dataset.")
+    parser.add_argument("-o", "--output", default=None, help="JSONL file for batch results, defaults to ./results/{dataset}_{method}_{graphrag}.jsonl.")
+    parser.add_argument("-c", "--concurrency", default=8, type=int, help="Questions in flight at once in batch mode.")
+    parser.add_argument("--llm_concurrency", default=LLM_MAX_CONCURRENCY, type=int, help="Global cap on in-flight LLM requests.")
+    parser.add_argument("--trace", default=None, help="Record per-stage spans to this file: JSONL if it ends in .jsonl, otherwise a Chrome trace.")
+    parser.add_argument("--record", default=None, help="Record every LLM response and graph retrieval to this file (gzipped JSONL).")
+    parser.add_argument("--replay", default=None, help="Serve LLM responses and graph retrievals from a --record file instead of the live services.")
+    parser.add_argument("--replay_latency", default="recorded", choices=["recorded", "zero"], help="Delay replayed calls by their recorded latency, or not at all.")
+    parser.add_argument("--replay_misses", default="error", choices=["error", "live"], help="Fail calls missing from the recording, or run them live.")
+    parser.add_argument("--prompt_layout", default=PROMPT_LAYOUT, choices=LAYOUTS, help="prefix_cache puts instructions and retrieval history before per-call inputs, for servers with prefix caching.")
+    parser.add_argument("--llm_base_urls", nargs="+", default=LLM_BASE_URLS, help="OpenAI-compatible LLM replicas to load-balance across.")
     args = parser.parse_args()
 
     if args.method in ["graphsearch", "grag"]:
         grag_method = initialize_grag(grag_name=args.graphrag, top_k=args.top_k, dataset=args.dataset)
 
     if args.method in ["naiverag"]:
-        corpus_file = f"./datasets/contexts/{args.dataset}.txt"
-        with open(corpus_file, "r", encoding="utf-8") as f:
-            documents = f.readlines()
+        documents = open_corpus(args.dataset)
         index, embed_model = load_vdb(args.dataset, documents)
 
-    question = "In what league did Jose Miranda's team compete?"
+    set_llm_concurrency(args.llm_concurrency)
+    set_prompt_layout(args.prompt_layout)
+    if args.trace is not None:
+        enable_tracing()
+    if args.record is not None:
+        enable_recording(args.record, metadata={"dataset": args.dataset, "method": args.method, "graphrag": args.graphrag, "top_k": args.top_k})
+    if args.replay is not None:
+        enable_replay(args.replay, latency=args.replay_latency, strict=args.replay_misses == "error")
+    set_llm_endpoints(args.llm_base_urls)
+
     if args.method == "vanillallm":
-        asyncio.run(vanilla_llm_reasoning(question))
+        reason = lambda question: vanilla_llm_reasoning(question)
     elif args.method == "naiverag":
-        asyncio.run(naive_rag_reasoning(question, documents, index, embed_model, args.top_k))
+        reason = lambda question: naive_rag_reasoning(question, documents, index, args.top_k)
     elif args.method == "grag":
-        asyncio.run(naive_grag_reasoning(question, grag_method))
+        reason = lambda question: naive_grag_reasoning(question, grag_method)
     elif args.method == "graphsearch":
-        asyncio.run(graph_search_reasoning(question, grag_method))
+        reason = lambda question: graph_search_reasoning(question, grag_method)
+
+    if args.question is not None:
+        asyncio.run(run_reasoning(reason(args.question), args.trace))
+    else:
+        output_file = args.output or f"./results/{args.dataset}_{args.method}_{args.graphrag}.jsonl"
+        questions = load_questions(args.dataset)
+        if args.method == "naiverag":
+            # retrieve for the whole dataset up front with one encoder batch and one index search
+            texts = [item["question"] for item in questions]
+            retrieved = dict(zip(texts, vdb_retrieve_batch(texts, documents, index, embed_model, args.top_k)))
+            reason = lambda question: naive_rag_reasoning(question, documents, index, args.top_k, retrieved.get(question))
+        asyncio.run(run_reasoning(run_batch(questions, reason, output_file, args.concurrency), args.trace))
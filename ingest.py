@@ -0,0 +1,105 @@
+import os
+import time
+import hashlib
+import logging
+from itertools import islice
+
+from llm.limiter import get_llm_limiter
+from runner import end_partial_line
+
+def document_hash(document: str) -> str:
+    return hashlib.md5(document.strip().encode("utf-8")).hexdigest()
+
+class IngestCheckpoint:
+    """Append-only file of the hashes of documents already inserted into the graph."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.done = set()
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                # a hash cut off by a crash is simply not recognised
+                self.done = {line.strip() for line in f if len(line.strip()) == 32}
+            end_partial_line(path)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._file = open(path, "a")
+
+    def mark(self, hashes: list[str]):
+        self.done.update(hashes)
+        self._file.write("".join(f"{h}\n" for h in hashes))
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+def iter_documents(corpus_file: str, one_per_line: bool):
+    """Yield the documents of a context file: every non-empty line, or the whole file as a single document."""
+    with open(corpus_file, "r", encoding="utf-8") as f:
+        if not one_per_line:
+            yield f.read()
+            return
+        for line in f:
+            if line.strip():
+                yield line
+
+def iter_batches(documents, batch_size: int):
+    documents = iter(documents)
+    while batch := list(islice(documents, batch_size)):
+        yield batch
+
+async def ingest(grag_method, documents, checkpoint: IngestCheckpoint, batch_size: int):
+    """
+    Insert `documents` into the graph in batches of `batch_size`, one batch
+    at a time; the backend parallelises within a batch (`max_parallel_insert`).
+    Documents whose hash is in the checkpoint are skipped. After each insert
+    only the documents the backend reports as processed are checkpointed, so
+    an interrupted build resumes where it stopped and documents the backend
+    merely queued are submitted again.
+    """
+    limiter = get_llm_limiter()
+    start = time.perf_counter()
+    start_llm_calls = limiter.requests
+    start_chunks = grag_method.count_chunks()
+    stats = {"docs": 0, "skipped": 0, "pending": 0, "failed": 0}
+
+    def report():
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        message = f"{stats['docs']} docs inserted ({stats['skipped']} skipped, {stats['pending']} pending, {stats['failed']} failed), {stats['docs'] / elapsed:.2f} docs/s"
+        chunks = grag_method.count_chunks()
+        if chunks is not None and start_chunks is not None:
+            message += f", {(chunks - start_chunks) / elapsed:.2f} chunks/s"
+        message += f", {(limiter.requests - start_llm_calls) / elapsed:.2f} LLM calls/s"
+        logging.info(message)
+
+    scheduled = set()  # hashes of documents already in a batch, so repeats are not inserted twice
+    for batch in iter_batches(documents, batch_size):
+        pending = {}
+        for document in batch:
+            h = document_hash(document)
+            if h in checkpoint.done or h in scheduled:
+                stats["skipped"] += 1
+                continue
+            pending[h] = document
+            scheduled.add(h)
+        if not pending:
+            continue
+
+        # batches are not overlapped: LightRAG only queues documents while another insert holds its
+        # pipeline, and the nano-graphrag-derived backends would race their entity merges
+        try:
+            await grag_method.ainsert(list(pending.values()))
+            processed = await grag_method.processed_documents(list(pending))
+        except Exception:
+            # not checkpointed, so the next run retries the batch
+            logging.exception(f"Inserting a batch of {len(pending)} documents failed")
+            stats["failed"] += len(pending)
+            continue
+        checkpoint.mark([h for h in pending if h in processed])
+        stats["docs"] += len(processed)
+        stats["pending"] += len(pending) - len(processed)
+        if len(processed) < len(pending):
+            logging.warning(f"{len(pending) - len(processed)} documents of the batch were not processed yet; they are retried on the next run")
+        report()
+
+    report()
+    return stats
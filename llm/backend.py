@@ -0,0 +1,42 @@
+from config import MODEL_NAME, LLM_API_KEY
+from .limiter import get_llm_limiter
+from .retry import call_with_retries
+from .endpoints import get_endpoint_pool
+
+def backend_llm_func(complete_if_cache, stage: str = "graphrag"):
+    """
+    Turn a GraphRAG backend's `openai_complete_if_cache` into its
+    `llm_model_func`. Calls share the pipeline's LLM limiter and replicas, so
+    graph construction and retrieval are scheduled together with reasoning.
+    The backend's own tenacity retries are bypassed: they would back off
+    inside one limiter slot and hide overloads from the limiter, so each
+    attempt takes its own slot and is retried by `call_with_retries` instead.
+    """
+    # tenacity's decorator keeps the undecorated function as __wrapped__
+    complete = getattr(complete_if_cache, "__wrapped__", complete_if_cache)
+
+    async def llm_model_func(
+        prompt,
+        system_prompt="",
+        history_messages=[],
+        keyword_extraction=False,
+        **kwargs,
+    ) -> str:
+        async def attempt():
+            return await get_llm_limiter().run(
+                lambda: get_endpoint_pool().run(
+                    lambda base_url: complete(
+                        model=MODEL_NAME,
+                        prompt=prompt,
+                        system_prompt=system_prompt,
+                        history_messages=history_messages,
+                        base_url=base_url,
+                        api_key=LLM_API_KEY,
+                        **kwargs,
+                    )
+                )
+            )
+
+        return await call_with_retries(attempt, stage=stage)
+
+    return llm_model_func
@@ -0,0 +1,151 @@
+import os
+import time
+import asyncio
+import sqlite3
+import threading
+
+from config import LLM_CACHE_ENABLED, LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL
+
+ACCESS_FLUSH_SIZE = 256  # hits whose access time is kept in memory before being written
+
+class LLMResponseCache:
+    """
+    SQLite-backed LLM response cache with LRU and TTL eviction. Hits update
+    their access time in memory and are written in batches, so a lookup
+    costs one read; use `aget`/`aset` from async code to keep the queries
+    off the event loop.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl: float | None = None):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._accessed = {}  # key -> access time not yet written
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        # WAL stays consistent without an fsync per commit; a crash loses at most the last few entries
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS llm_cache_last_access ON llm_cache(last_access)")
+        self._purge_expired()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+
+    def _purge_expired(self):
+        if self.ttl is None:
+            return
+        cur = self._conn.execute("DELETE FROM llm_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        self.evictions += cur.rowcount
+
+    def get(self, key: str) -> str | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None and self.ttl is not None and row[1] < now - self.ttl:
+                self._conn.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                self._accessed.pop(key, None)
+                self._size -= 1
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._accessed[key] = now
+            if len(self._accessed) >= ACCESS_FLUSH_SIZE:
+                self._flush_accessed()
+            self.hits += 1
+            return row[0]
+
+    def _flush_accessed(self):
+        if not self._accessed:
+            return
+        self._conn.execute("BEGIN")
+        self._conn.executemany("UPDATE llm_cache SET last_access = ? WHERE key = ?", [(t, k) for k, t in self._accessed.items()])
+        self._conn.execute("COMMIT")
+        self._accessed.clear()
+
+    def flush(self):
+        """Write the access times of recent hits, so the next run evicts in the right order."""
+        with self._lock:
+            self._flush_accessed()
+
+    async def aget(self, key: str) -> str | None:
+        return await asyncio.to_thread(self.get, key)
+
+    async def aset(self, key: str, response: str):
+        await asyncio.to_thread(self.set, key, response)
+
+    def set(self, key: str, response: str):
+        now = time.time()
+        with self._lock:
+            self._accessed.pop(key, None)
+            cur = self._conn.execute(
+                "INSERT OR IGNORE INTO llm_cache (key, response, created_at, last_access) VALUES (?, ?, ?, ?)",
+                (key, response, now, now),
+            )
+            if cur.rowcount == 0:
+                self._conn.execute(
+                    "UPDATE llm_cache SET response = ?, created_at = ?, last_access = ? WHERE key = ?",
+                    (response, now, now, key),
+                )
+                return
+            self._size += 1
+            overflow = self._size - self.max_entries
+            if overflow > 0:
+                # evict by the latest access times
+                self._flush_accessed()
+                cur = self._conn.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY last_access ASC LIMIT ?)",
+                    (overflow,),
+                )
+                self._size -= cur.rowcount
+                self.evictions += cur.rowcount
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM llm_cache")
+            self._accessed.clear()
+            self._size = 0
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": self._size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            self._flush_accessed()
+            self._conn.close()
+
+_LLM_CACHE: LLMResponseCache | None = None
+_ENABLED = LLM_CACHE_ENABLED
+
+def set_llm_cache_enabled(enabled: bool):
+    global _ENABLED
+    _ENABLED = enabled
+
+def get_llm_cache() -> LLMResponseCache | None:
+    """Return the process-wide response cache, or None when LLM_CACHE_ENABLED is off."""
+    global _LLM_CACHE
+    if not _ENABLED:
+        return None
+    if _LLM_CACHE is None:
+        _LLM_CACHE = LLMResponseCache(LLM_CACHE_PATH, LLM_CACHE_MAX_ENTRIES, LLM_CACHE_TTL)
+    return _LLM_CACHE
@@ -0,0 +1,45 @@
+import asyncio
+
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+import httpx
+
+from config import (
+    LLM_API_KEY,
+    LLM_BASE_URL,
+    LLM_MAX_CONNECTIONS,
+    LLM_MAX_KEEPALIVE_CONNECTIONS,
+    LLM_KEEPALIVE_EXPIRY,
+    LLM_TIMEOUT
+)
+
+# base_url -> (event loop, client). The underlying httpx pool is bound to the
+# loop it was created on, so a new asyncio.run() gets a fresh client.
+_CLIENTS: dict[str, tuple[asyncio.AbstractEventLoop, AsyncOpenAI]] = {}
+
+def get_openai_client(base_url: str = LLM_BASE_URL, api_key: str = LLM_API_KEY) -> AsyncOpenAI:
+    """Return the process-wide AsyncOpenAI client for `base_url`, creating it on first use."""
+    loop = asyncio.get_running_loop()
+    entry = _CLIENTS.get(base_url)
+    if entry is not None and entry[0] is loop and not entry[1].is_closed():
+        return entry[1]
+
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=LLM_KEEPALIVE_EXPIRY,
+        ),
+        timeout=LLM_TIMEOUT,
+    )
+    # retries are handled by llm.retry, with backoff and per-stage accounting
+    client = AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=http_client, max_retries=0)
+    _CLIENTS[base_url] = (loop, client)
+    return client
+
+async def close_openai_clients():
+    """Close every pooled client owned by the running loop. Call before the loop exits."""
+    loop = asyncio.get_running_loop()
+    for base_url, (client_loop, client) in list(_CLIENTS.items()):
+        if client_loop is loop:
+            await client.close()
+        del _CLIENTS[base_url]
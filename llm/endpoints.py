@@ -0,0 +1,171 @@
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import (
+    LLM_BASE_URLS,
+    LLM_ROUTING,
+    LLM_SESSION_AFFINITY,
+    LLM_EJECT_AFTER_FAILURES,
+    LLM_EJECT_SECONDS,
+    LLM_HEALTH_CHECK_INTERVAL
+)
+from .limiter import is_overload_error
+
+_SESSION: ContextVar[str | None] = ContextVar("llm_session", default=None)
+
+@contextmanager
+def llm_session(key: str):
+    """Route every LLM call made inside this block (including spawned tasks) to the same replica while it stays healthy."""
+    token = _SESSION.set(key)
+    try:
+        yield
+    finally:
+        _SESSION.reset(token)
+
+class Endpoint:
+    def __init__(self, url: str):
+        self.url = url
+        self.outstanding = 0
+        self.latency_ewma = None
+        self.consecutive_failures = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.failures = 0
+
+    def is_available(self, now: float) -> bool:
+        return now >= self.ejected_until
+
+    def cost(self) -> float:
+        if LLM_ROUTING == "latency":
+            # expected wait if the new request queues behind the outstanding ones
+            return (self.outstanding + 1) * (self.latency_ewma or 0.0)
+        return self.outstanding
+
+class EndpointPool:
+    """
+    Routes LLM requests over several OpenAI-compatible replicas.
+
+    Requests go to the available replica with the fewest outstanding requests
+    (or lowest expected latency with LLM_ROUTING = "latency"), optionally
+    sticking to one replica per session. A replica that fails
+    LLM_EJECT_AFTER_FAILURES times in a row is ejected for LLM_EJECT_SECONDS
+    and readmitted early if a health check succeeds.
+    """
+
+    def __init__(self, urls: list[str], session_affinity: bool = LLM_SESSION_AFFINITY, max_sessions: int = 10000):
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.session_affinity = session_affinity
+        self.max_sessions = max_sessions
+        self._sessions = OrderedDict()
+        self._last_health_check = 0.0
+        self._health_tasks = set()
+
+    def choose(self) -> Endpoint:
+        now = time.monotonic()
+        self._maybe_check_health(now)
+        available = [e for e in self.endpoints if e.is_available(now)]
+        if not available:
+            # everything is ejected: try the replica that comes back first rather than failing outright
+            return min(self.endpoints, key=lambda e: e.ejected_until)
+
+        session = _SESSION.get() if self.session_affinity and len(self.endpoints) > 1 else None
+        if session is not None:
+            endpoint = self._sessions.get(session)
+            if endpoint is not None and endpoint.is_available(now):
+                self._sessions.move_to_end(session)
+                return endpoint
+
+        endpoint = min(available, key=lambda e: e.cost())
+        if session is not None:
+            self._sessions[session] = endpoint
+            self._sessions.move_to_end(session)
+            while len(self._sessions) > self.max_sessions:
+                self._sessions.popitem(last=False)
+        return endpoint
+
+    def record(self, endpoint: Endpoint, latency: float, failed: bool):
+        endpoint.requests += 1
+        if not failed:
+            endpoint.consecutive_failures = 0
+            endpoint.latency_ewma = latency if endpoint.latency_ewma is None else 0.8 * endpoint.latency_ewma + 0.2 * latency
+            return
+
+        endpoint.failures += 1
+        endpoint.consecutive_failures += 1
+        now = time.monotonic()
+        if endpoint.consecutive_failures >= LLM_EJECT_AFTER_FAILURES and len(self.endpoints) > 1 and endpoint.is_available(now):
+            endpoint.ejected_until = now + LLM_EJECT_SECONDS
+            logging.warning(f"Ejecting LLM endpoint {endpoint.url} for {LLM_EJECT_SECONDS:.0f}s after {endpoint.consecutive_failures} failures")
+
+    async def run(self, call):
+        """Await `call(base_url)` on the chosen replica and record the outcome."""
+        endpoint = self.choose()
+        endpoint.outstanding += 1
+        start = time.perf_counter()
+        try:
+            result = await call(endpoint.url)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.record(endpoint, time.perf_counter() - start, failed=is_overload_error(e))
+            raise
+        finally:
+            endpoint.outstanding -= 1
+        self.record(endpoint, time.perf_counter() - start, failed=False)
+        return result
+
+    def _maybe_check_health(self, now: float):
+        if LLM_HEALTH_CHECK_INTERVAL is None or now - self._last_health_check < LLM_HEALTH_CHECK_INTERVAL:
+            return
+        ejected = [e for e in self.endpoints if not e.is_available(now)]
+        self._last_health_check = now
+        if not ejected:
+            return
+        task = asyncio.ensure_future(self.check_health(ejected))
+        self._health_tasks.add(task)
+        task.add_done_callback(self._health_tasks.discard)
+
+    async def check_health(self, endpoints: list[Endpoint] | None = None, timeout: float = 5.0):
+        """Probe `GET /models` on each endpoint and readmit the ones that answer."""
+        from .client import get_openai_client
+
+        async def probe(endpoint):
+            try:
+                await asyncio.wait_for(get_openai_client(endpoint.url).models.list(), timeout=timeout)
+            except Exception:
+                return False
+            endpoint.ejected_until = 0.0
+            endpoint.consecutive_failures = 0
+            return True
+
+        endpoints = self.endpoints if endpoints is None else endpoints
+        return dict(zip([e.url for e in endpoints], await asyncio.gather(*(probe(e) for e in endpoints))))
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        return {
+            e.url: {
+                "outstanding": e.outstanding,
+                "requests": e.requests,
+                "failures": e.failures,
+                "latency_ewma": e.latency_ewma or 0.0,
+                "ejected": not e.is_available(now),
+            }
+            for e in self.endpoints
+        }
+
+_POOL: EndpointPool | None = None
+
+def set_llm_endpoints(urls: list[str]):
+    global _POOL
+    _POOL = EndpointPool(urls)
+
+def get_endpoint_pool() -> EndpointPool:
+    global _POOL
+    if _POOL is None:
+        _POOL = EndpointPool(LLM_BASE_URLS)
+    return _POOL
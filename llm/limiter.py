@@ -0,0 +1,149 @@
+import time
+import asyncio
+from collections import deque
+
+from config import (
+    LLM_MIN_CONCURRENCY,
+    LLM_INITIAL_CONCURRENCY,
+    LLM_MAX_CONCURRENCY,
+    LLM_LATENCY_TARGET
+)
+
+OVERLOAD_STATUS_CODES = {429, 500, 502, 503, 504}
+
+def is_overload_error(error: BaseException) -> bool:
+    """True for errors that mean the server is saturated (429/5xx, timeouts)."""
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    if type(error).__name__ in ("APITimeoutError", "APIConnectionError", "RateLimitError", "InternalServerError"):
+        return True
+    return getattr(error, "status_code", None) in OVERLOAD_STATUS_CODES
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency limiter shared by every LLM call in the process.
+
+    The limit grows by one after a full window of successful requests and is
+    multiplied by `backoff` (at most once per observed round-trip) when a
+    request fails with 429/5xx/timeout or, if `latency_target` is set, takes
+    longer than that. Waiters are served in FIFO order.
+    """
+
+    def __init__(self, min_limit: int, initial_limit: int, max_limit: int, latency_target: float | None = None, backoff: float = 0.7):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.latency_target = latency_target
+        self.backoff = backoff
+
+        self.in_flight = 0
+        self._waiters = deque()
+        self._latency_ewma = None
+        self._last_decrease = 0.0
+
+        self.requests = 0
+        self.overloads = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def queue_depth(self) -> int:
+        return len(self._waiters)
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                self.in_flight += 1
+                waiter.set_result(None)
+
+    async def acquire(self):
+        start = time.perf_counter()
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # the slot was granted just before we were cancelled
+                    self.in_flight -= 1
+                    self._wake()
+                else:
+                    try:
+                        self._waiters.remove(waiter)
+                    except ValueError:
+                        pass
+                raise
+        waited = time.perf_counter() - start
+        self.requests += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+    def release(self, latency: float, overloaded: bool = False):
+        self.in_flight -= 1
+        self._latency_ewma = latency if self._latency_ewma is None else 0.8 * self._latency_ewma + 0.2 * latency
+
+        congested = overloaded or (self.latency_target is not None and latency > self.latency_target)
+        now = time.perf_counter()
+        if congested:
+            self.overloads += int(overloaded)
+            if now - self._last_decrease >= (self._latency_ewma or 0.0):
+                self.limit = max(float(self.min_limit), self.limit * self.backoff)
+                self._last_decrease = now
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1.0 / self.limit)
+        self._wake()
+
+    async def run(self, call):
+        """Await `call()` inside a slot and feed its outcome back into the limit."""
+        await self.acquire()
+        start = time.perf_counter()
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            self.in_flight -= 1
+            self._wake()
+            raise
+        except Exception as e:
+            self.release(time.perf_counter() - start, overloaded=is_overload_error(e))
+            raise
+        self.release(time.perf_counter() - start)
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "limit": int(self.limit),
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "requests": self.requests,
+            "overloads": self.overloads,
+            "wait_mean": self.wait_total / self.requests if self.requests else 0.0,
+            "wait_max": self.wait_max,
+            "latency_ewma": self._latency_ewma or 0.0,
+        }
+
+# (event loop, limiter); the waiter futures belong to one loop, like the pooled clients
+_LIMITER: tuple[asyncio.AbstractEventLoop, AdaptiveLimiter] | None = None
+_MAX_CONCURRENCY = LLM_MAX_CONCURRENCY
+
+def set_llm_concurrency(max_concurrency: int):
+    """Set the process-wide cap on in-flight LLM requests."""
+    global _LIMITER, _MAX_CONCURRENCY
+    _MAX_CONCURRENCY = max_concurrency
+    _LIMITER = None
+
+def get_llm_limiter() -> AdaptiveLimiter:
+    global _LIMITER
+    loop = asyncio.get_running_loop()
+    if _LIMITER is None or _LIMITER[0] is not loop:
+        limiter = AdaptiveLimiter(
+            min_limit=min(LLM_MIN_CONCURRENCY, _MAX_CONCURRENCY),
+            initial_limit=min(LLM_INITIAL_CONCURRENCY, _MAX_CONCURRENCY),
+            max_limit=_MAX_CONCURRENCY,
+            latency_target=LLM_LATENCY_TARGET,
+        )
+        _LIMITER = (loop, limiter)
+    return _LIMITER[1]
@@ -0,0 +1,91 @@
+import os
+from bisect import bisect_right
+from collections import defaultdict, OrderedDict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from config import PREFIX_STATS
+
+_TOTALS = defaultdict(int)
+# the last prompt of each stage, shared by every question, since the server's cache is too
+_LAST_BY_STAGE: OrderedDict[str, str] = OrderedDict()
+_MAX_STAGES = 64
+_ENABLED = PREFIX_STATS
+
+def set_prefix_stats_enabled(enabled: bool):
+    global _ENABLED
+    _ENABLED = enabled
+
+def prefix_stats_enabled() -> bool:
+    """Whether questions measure their shared prompt prefixes: if PREFIX_STATS is on, the prefix_cache layout is used or tracing is active."""
+    from deepsearch.layout import get_prompt_layout
+    from tracing import get_tracer
+
+    return _ENABLED or get_prompt_layout() == "prefix_cache" or get_tracer() is not None
+
+def prefix_stats() -> dict:
+    """Prompt tokens and the part of them shared with an earlier prompt, over every question so far."""
+    totals = dict(_TOTALS)
+    totals["shared_ratio"] = totals["shared_prefix_tokens"] / totals["prompt_tokens"] if totals.get("prompt_tokens") else 0.0
+    return totals
+
+class PrefixTracker:
+    """
+    Measures how much of each prompt of one question repeats the start of an
+    earlier prompt (of the same question, or the last one of the same stage),
+    i.e. the tokens a server with automatic prefix caching need not prefill.
+    """
+
+    def __init__(self):
+        self.prompts = []
+        self.calls = 0
+        self.prompt_tokens = 0
+        self.shared_prefix_tokens = 0
+
+    def observe(self, stage: str, prompt: str) -> tuple[int, int]:
+        """(prompt tokens, shared-prefix tokens) of `prompt`, recorded towards the question's totals."""
+        from tokens import get_tokenizer
+
+        earlier = self.prompts + [_LAST_BY_STAGE.get(stage, "")]
+        shared_chars = max(len(os.path.commonprefix([prompt, p])) for p in earlier)
+        # one pass without the token count cache, since prompts are rarely seen twice; the shared
+        # prefix is made of the tokens that end inside it
+        offsets = get_tokenizer()(prompt, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        prompt_tokens = len(offsets)
+        shared_tokens = bisect_right([end for _, end in offsets], shared_chars)
+
+        self.prompts.append(prompt)
+        _LAST_BY_STAGE[stage] = prompt
+        _LAST_BY_STAGE.move_to_end(stage)
+        if len(_LAST_BY_STAGE) > _MAX_STAGES:
+            _LAST_BY_STAGE.popitem(last=False)
+        self.calls += 1
+        self.prompt_tokens += prompt_tokens
+        self.shared_prefix_tokens += shared_tokens
+        _TOTALS["calls"] += 1
+        _TOTALS["prompt_tokens"] += prompt_tokens
+        _TOTALS["shared_prefix_tokens"] += shared_tokens
+        return prompt_tokens, shared_tokens
+
+    def stats(self) -> dict:
+        return {
+            "calls": self.calls,
+            "prompt_tokens": self.prompt_tokens,
+            "shared_prefix_tokens": self.shared_prefix_tokens,
+            "shared_ratio": self.shared_prefix_tokens / self.prompt_tokens if self.prompt_tokens else 0.0,
+        }
+
+_TRACKER: ContextVar[PrefixTracker | None] = ContextVar("prefix_tracker", default=None)
+
+@contextmanager
+def prefix_scope():
+    """Measure the shared-prefix tokens of every LLM call made inside this block (including spawned tasks)."""
+    tracker = PrefixTracker()
+    token = _TRACKER.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _TRACKER.reset(token)
+
+def get_prefix_tracker() -> PrefixTracker | None:
+    return _TRACKER.get()
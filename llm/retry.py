@@ -0,0 +1,66 @@
+import random
+import asyncio
+import logging
+from collections import defaultdict
+
+from config import LLM_MAX_RETRIES, LLM_BACKOFF_BASE, LLM_BACKOFF_MAX
+from .limiter import is_overload_error
+
+# stage -> counters, reported by infer.py at shutdown
+_STAGE_STATS = defaultdict(lambda: {"calls": 0, "retries": 0, "hedges": 0, "failures": 0})
+
+def retry_stats() -> dict:
+    return {stage: dict(stats) for stage, stats in _STAGE_STATS.items()}
+
+def is_retryable(error: BaseException) -> bool:
+    # overloads, timeouts and dropped connections are transient; other 4xx (bad request,
+    # context length exceeded) will fail the same way again
+    return is_overload_error(error)
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff."""
+    return random.uniform(0, min(LLM_BACKOFF_MAX, LLM_BACKOFF_BASE * 2 ** attempt))
+
+async def hedged(attempt, hedge_delay: float, stats: dict):
+    """
+    Start `attempt()`, and if it has not finished after `hedge_delay` seconds
+    start a second identical request. The first success wins and the other
+    request is cancelled.
+    """
+    first = asyncio.ensure_future(attempt())
+    done, _ = await asyncio.wait({first}, timeout=hedge_delay)
+    if done:
+        return first.result()
+
+    stats["hedges"] += 1
+    pending = {first, asyncio.ensure_future(attempt())}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+async def call_with_retries(attempt, stage: str = "default", max_retries: int = LLM_MAX_RETRIES, hedge_delay: float | None = None):
+    """Await `attempt()`, retrying transient failures with jittered exponential backoff."""
+    stats = _STAGE_STATS[stage]
+    stats["calls"] += 1
+    for i in range(max_retries + 1):
+        try:
+            if hedge_delay is not None:
+                return await hedged(attempt, hedge_delay, stats)
+            return await attempt()
+        except Exception as e:
+            if i == max_retries or not is_retryable(e):
+                stats["failures"] += 1
+                raise
+            stats["retries"] += 1
+            delay = backoff_delay(i)
+            logging.warning(f"LLM call for {stage} failed ({type(e).__name__}), retry {i + 1}/{max_retries} in {delay:.1f}s")
+            await asyncio.sleep(delay)
@@ -1,20 +1,29 @@
 import os
 import re
+import asyncio
 import logging
+from contextlib import nullcontext
 
 from graphrags.base import GraphRAGBase
+from deepsearch.layout import get_prompt_layout
 from deepsearch.components import question_decomposition_deep, question_decomposition_deep_kg, answer_generation, query_completer, kg_query_completer, text_summary, kg_summary, answer_generation_deep, evidence_verification, query_expansion
-from utils import format_history_context, extract_words_str, openai_complete, vdb_retrieve, normalize, parse_expanded_queries
-from config import EMBED_MODEL_NAME
+from utils import format_history_context, parse_sub_query_dependencies, transitive_dependencies, extract_words_str, openai_complete, avdb_retrieve, normalize, parse_expanded_queries
+from llm.endpoints import llm_session
+from llm.prefix import prefix_scope, prefix_stats_enabled
+from tracing import traced, set_span_attributes
+from embedding import get_embed_model
+from tokens import count_tokens, token_budget, remaining_budget
+from config import EXPANSION_MAX_CONCURRENCY, CONTEXT_DEDUP
 
-def initialize_grag(grag_name:str, top_k:int, dataset:str):
-    from sentence_transformers import SentenceTransformer
+# stages that all read a channel's merged history
+DRAFTING_STAGES = ("answer_generation_deep", "evidence_verification", "query_expansion")
 
+def initialize_grag(grag_name:str, top_k:int, dataset:str):
     working_dir = f"./graphkb/{grag_name}/{dataset}"
     if not os.path.exists(working_dir):
         os.makedirs(working_dir, exist_ok=True)
 
-    EMBED_MODEL = SentenceTransformer(f"{EMBED_MODEL_NAME}", trust_remote_code=True)
+    EMBED_MODEL = get_embed_model()
 
     if grag_name == "lightrag":
         from graphrags.lightrag import LightRAGMethod
@@ -31,20 +40,26 @@ def initialize_grag(grag_name:str, top_k:int, dataset:str):
 
     return grag_method
 
+@traced("vanillallm", kind="question", record=("question",))
 async def vanilla_llm_reasoning(question:str):
     logging.info("Starting vanilla LLM reasoning...")
     logging.info(f"Question: {question}")
-    answer = await openai_complete(prompt=question["question"])
+    answer = await openai_complete(prompt=question)
     logging.info(f"Answer: {answer}")
+    return answer
 
-async def naive_rag_reasoning(question, documents, index, embed_model, top_k):
+@traced("naiverag", kind="question", record=("question",))
+async def naive_rag_reasoning(question, documents, index, top_k, retrieved_context=None):
     logging.info("Starting naive rag reasoning...")
     logging.info(f"Question: {question}")
-    retrieved_context = vdb_retrieve(question, documents, index, embed_model, top_k)
+    if retrieved_context is None:
+        retrieved_context = await avdb_retrieve(question, documents, index, top_k)
     logging.info(f"Retrieved Context: {retrieved_context}")
     answer = await answer_generation(question, "\n".join(retrieved_context))
     logging.info(f"Answer: {answer}")
+    return answer
 
+@traced("grag", kind="question", record=("question",))
 async def naive_grag_reasoning(question:str, grag_method:GraphRAGBase):
     logging.info("Starting agent deep reasoning...")
     logging.info(f"Question: {question}")
@@ -54,55 +69,116 @@ async def naive_grag_reasoning(question:str, grag_method:GraphRAGBase):
     
     answer = await grag_method.aquery_answer(question=question)
     logging.info(f"Answer: {answer}")
+    return answer
 
-async def graph_search_reasoning(question:str, grag_method:GraphRAGBase):
-    logging.info("Starting graph search reasoning...")
-    grag_context_data = await grag_method.aquery_context(question=question)
+def relied_on_entries(grag_method:GraphRAGBase, steps:list):
+    # history entries whose summaries later steps skipped records for; their context must not be trimmed away
+    relied_on = grag_method.summaries_relied_on()
+    return {i for i, step in enumerate(steps) if step in relied_on}
+
+async def gather_stages(*stages, concurrent=True):
+    if concurrent:
+        return await asyncio.gather(*stages)
+    return [await stage for stage in stages]
+
+async def initial_context_summary(question:str, grag_method:GraphRAGBase, concurrent=True):
+    grag_context_data = await grag_method.aquery_context_within(question=question, max_tokens=token_budget("text_summary", "kg_summary"), step="initial")
     logging.info(f"Initial Context: {grag_context_data}")
-    
-    grag_context_text_summary = await text_summary(question, grag_context_data)
+
+    grag_context_text_summary, grag_context_kg_summary = await gather_stages(
+        text_summary(question, grag_context_data),
+        kg_summary(question, grag_context_data),
+        concurrent=concurrent
+    )
     logging.info(f"Initial Context Text Summary: {grag_context_text_summary}")
-    grag_context_kg_summary = await kg_summary(question, grag_context_data)
     logging.info(f"Initial Context KG Summary: {grag_context_kg_summary}")
-        
-    # Question Decomposition
-    decomposition_output = await question_decomposition_deep(question)
-    kg_decomposition_output = await question_decomposition_deep_kg(question)
-    
-    sub_query_pattern = r'"Sub-query \d+":\s*"([^"]+)"'
-    sub_kg_query_pattern = r'"Sub-query \d+":\s*(\[[^\]]+\])'
-    sub_queries = re.findall(sub_query_pattern, decomposition_output)
-    sub_kg_queries = re.findall(sub_kg_query_pattern, kg_decomposition_output)
+    return grag_context_text_summary, grag_context_kg_summary
 
+async def answer_sub_query(sub_query:str, decomposition_output:str, text_query_history:list, grag_method:GraphRAGBase, numbers:list=None, number:int=None):
+    numbers = numbers or list(range(1, len(text_query_history) + 1))
+    number = number or len(text_query_history) + 1
+    if "#" in sub_query:
+        history_str = format_history_context(text_query_history, numbers, max_tokens=remaining_budget("query_completer", decomposition_output))
+        sub_query = await query_completer(sub_query, decomposition_output + "\n\n" + history_str)
+    logging.info(f"Sub Query: {sub_query}")
+    # retrieve the graph database, Semantic Filtering
+    # skip chunks that the sub-queries whose history this one sees have already summarized
+    sub_query_context = await grag_method.aquery_filtered_context(
+        question=sub_query, filter_type="semantic", max_tokens=token_budget("text_summary"),
+        step=f"text:{number}", after=[f"text:{n}" for n in numbers]
+    )
+    logging.info(f"Sub Query Context: {sub_query_context}")
+
+    # summarize the context for sub query, then try to answer use current context
+    sub_query_context_summary = await text_summary(sub_query, sub_query_context)
+    logging.info(f"Sub Query Context Summary: {sub_query_context_summary}")
+    # answer sub query
+    history_str = format_history_context(
+        text_query_history, numbers, max_tokens=remaining_budget("answer_generation", sub_query_context_summary),
+        keep=relied_on_entries(grag_method, [f"text:{n}" for n in numbers])
+    )
+    sub_query_context_data = history_str + "\n\n" + sub_query_context_summary
+    sub_query_answer = await answer_generation(sub_query, sub_query_context_data)
+    logging.info(f"Sub Query Answer: {sub_query_answer}")
+
+    return sub_query, sub_query_context_summary, sub_query_answer
+
+async def answer_sub_queries_dag(sub_queries:list, decomposition_output:str, grag_method:GraphRAGBase):
+    # A sub-query starts as soon as the sub-queries its `#N` placeholders refer to are answered,
+    # and only sees their history, numbered as in the decomposition
+    dependencies = parse_sub_query_dependencies(sub_queries)
+    ancestors = transitive_dependencies(dependencies)
+    tasks = []
+
+    async def run(i):
+        await asyncio.gather(*(tasks[d] for d in dependencies[i]))
+        numbers = sorted(ancestors[i])
+        history = [tasks[d].result() for d in numbers]
+        return await answer_sub_query(sub_queries[i], decomposition_output, history, grag_method, numbers=[d + 1 for d in numbers], number=i + 1)
+
+    for i in range(len(sub_queries)):
+        tasks.append(asyncio.ensure_future(run(i)))
+    try:
+        return list(await asyncio.gather(*tasks))
+    finally:
+        # if one sub-query fails (or the question is cancelled), stop the others' LLM and retrieval calls
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+async def answer_expanded_queries(expanded_queries:list, grag_method:GraphRAGBase, filter_type:str, summarize, log_label:str, concurrent:bool=True, max_tokens:int=None, step:str=None):
+    # Expanded queries are independent; fan them out but keep the history in their original order.
+    # Their summaries only feed the final answer, which sees every earlier summary, so any record sent before is skipped
+    semaphore = asyncio.Semaphore(EXPANSION_MAX_CONCURRENCY if concurrent else 1)
+
+    async def run(expanded_query):
+        async with semaphore:
+            expanded_query_context = await grag_method.aquery_filtered_context(question=expanded_query, filter_type=filter_type, max_tokens=max_tokens, step=step)
+            logging.info(f"{log_label} Context: {expanded_query_context}")
+
+            expanded_query_context_summary = await summarize(expanded_query, expanded_query_context)
+            logging.info(f"{log_label} Context Summary: {expanded_query_context_summary}")
+            return expanded_query, expanded_query_context_summary, ""
+
+    return await asyncio.gather(*(run(expanded_query) for expanded_query in expanded_queries))
+
+async def text_channel_reasoning(question:str, decomposition_output:str, grag_method:GraphRAGBase, concurrent:bool=True):
+    sub_query_pattern = r'"Sub-query \d+":\s*"([^"]+)"'
+    # fall back to the question itself rather than drafting an answer from no evidence at all
+    sub_queries = re.findall(sub_query_pattern, decomposition_output) or [question]
     logging.info(f"Sub Queries: {sub_queries}")
-    logging.info(f"Sub KG Queries: {sub_kg_queries}")
 
-    text_query_history = []
-    
     # Iterative Retrieval
-    for i, sub_query in enumerate(sub_queries):
-        text_query_history_str = format_history_context(text_query_history)
-        if "#" in sub_query:
-            sub_query = await query_completer(sub_query, decomposition_output + "\n\n" + text_query_history_str)
-        logging.info(f"Sub Query: {sub_query}")
-        # retrieve the graph database
-        sub_query_context = await grag_method.aquery_context(question=sub_query)
-        # Semantic Filtering
-        sub_query_context = grag_method.context_filter(context_data=sub_query_context, filter_type="semantic")
-        logging.info(f"Sub Query Context: {sub_query_context}")
-
-        # summarize the context for sub query, then try to answer use current context
-        sub_query_context_summary = await text_summary(sub_query, sub_query_context)
-        logging.info(f"Sub Query Context Summary: {sub_query_context_summary}")
-        # answer sub query
-        sub_query_context_data = text_query_history_str + "\n\n" + sub_query_context_summary
-        sub_query_answer = await answer_generation(sub_query, sub_query_context_data)
-        logging.info(f"Sub Query Answer: {sub_query_answer}")
-
-        text_query_history.append((sub_query, sub_query_context_summary, sub_query_answer))
+    text_query_steps = [f"text:{i + 1}" for i in range(len(sub_queries))]
+    if concurrent:
+        text_query_history = await answer_sub_queries_dag(sub_queries, decomposition_output, grag_method)
+    else:
+        text_query_history = []
+        for sub_query in sub_queries:
+            text_query_history.append(await answer_sub_query(sub_query, decomposition_output, list(text_query_history), grag_method))
 
     # merge the history
-    text_query_history_str = format_history_context(text_query_history)
+    text_query_history_str = format_history_context(text_query_history, max_tokens=token_budget(*DRAFTING_STAGES), keep=relied_on_entries(grag_method, text_query_steps))
     # Logic Drafting
     text_final_answer = await answer_generation_deep(question, text_query_history_str)
     logging.info(f"Logic Drafting: {text_final_answer}")
@@ -116,35 +192,41 @@ async def graph_search_reasoning(question:str, grag_method:GraphRAGBase):
     if "yes" in normalize(text_verification_result):
         query_expansion_result = await query_expansion(question, text_query_history_str, text_final_answer, text_verification_result)
         expanded_queries = parse_expanded_queries(query_expansion_result)
-    
-        for expanded_query in expanded_queries:
-            expanded_query_context = await grag_method.aquery_context(question=expanded_query)
-            expanded_query_context = grag_method.context_filter(context_data=expanded_query_context, filter_type="semantic")
-            logging.info(f"Expanded Query Context: {expanded_query_context}")
-            
-            expanded_query_context_summary = await text_summary(expanded_query, expanded_query_context)
-            logging.info(f"Expanded Query Context Summary: {expanded_query_context_summary}")
-            
-            text_query_history.append((expanded_query, expanded_query_context_summary, ""))
-            
-        text_query_history_str = format_history_context(text_query_history)
-        
+        text_query_history.extend(await answer_expanded_queries(
+            expanded_queries, grag_method, "semantic", text_summary, "Expanded Query", concurrent=concurrent, max_tokens=token_budget("text_summary"), step="text:expansion"
+        ))
+        text_query_steps += ["text:expansion"] * len(expanded_queries)
+
+    return text_query_history, text_query_steps
+
+async def kg_channel_reasoning(question:str, kg_decomposition_output:str, grag_method:GraphRAGBase, concurrent:bool=True):
+    sub_kg_query_pattern = r'"Sub-query \d+":\s*(\[[^\]]+\])'
+    sub_kg_queries = re.findall(sub_kg_query_pattern, kg_decomposition_output) or [question]
+    logging.info(f"Sub KG Queries: {sub_kg_queries}")
+
     kg_query_history = []
     for i, sub_kg_query in enumerate(sub_kg_queries):
-        kg_query_history_str = format_history_context(kg_query_history)
         if i > 0:
+            kg_query_history_str = format_history_context(kg_query_history, max_tokens=remaining_budget("kg_query_completer", kg_decomposition_output))
             sub_kg_query = await kg_query_completer(sub_kg_query, kg_decomposition_output + "\n\n" + kg_query_history_str)
         
         logging.info(f"Sub KG Query: {sub_kg_query}")
         sub_kg_query_cleaned = extract_words_str(sub_kg_query)
-        sub_kg_query_context = await grag_method.aquery_context(question=sub_kg_query_cleaned)
         # Relational Channel
-        sub_kg_query_context = grag_method.context_filter(context_data=sub_kg_query_context, filter_type="relational")
+        # every earlier KG sub-query's summary is in this one's history
+        sub_kg_query_context = await grag_method.aquery_filtered_context(
+            question=sub_kg_query_cleaned, filter_type="relational", max_tokens=token_budget("kg_summary"),
+            step=f"kg:{i + 1}", after=[f"kg:{n}" for n in range(1, i + 1)]
+        )
         logging.info(f"Sub KG Query Context: {sub_kg_query_context}")
         
         sub_kg_query_context_summary = await kg_summary(sub_kg_query, sub_kg_query_context)
         logging.info(f"Sub KG Query Context Summary: {sub_kg_query_context_summary}")
 
+        kg_query_history_str = format_history_context(
+            kg_query_history, max_tokens=remaining_budget("answer_generation", sub_kg_query_context_summary),
+            keep=relied_on_entries(grag_method, [f"kg:{n}" for n in range(1, i + 1)])
+        )
         sub_kg_query_context_data = kg_query_history_str + "\n\n" + sub_kg_query_context_summary
         sub_kg_query_answer = await answer_generation(sub_kg_query, sub_kg_query_context_data)
         logging.info(f"Sub KG Query Answer: {sub_kg_query_answer}")
@@ -152,7 +234,8 @@ async def graph_search_reasoning(question:str, grag_method:GraphRAGBase):
         kg_query_history.append((sub_kg_query, sub_kg_query_context_summary, sub_kg_query_answer))
 
     # merge the history
-    kg_query_history_str = format_history_context(kg_query_history)
+    kg_query_steps = [f"kg:{i + 1}" for i in range(len(kg_query_history))]
+    kg_query_history_str = format_history_context(kg_query_history, max_tokens=token_budget(*DRAFTING_STAGES), keep=relied_on_entries(grag_method, kg_query_steps))
     # Logic Drafting
     kg_final_answer = await answer_generation_deep(question, kg_query_history_str)
     logging.info(f"KG Logic Drafting: {kg_final_answer}")
@@ -165,20 +248,63 @@ async def graph_search_reasoning(question:str, grag_method:GraphRAGBase):
     if "yes" in normalize(kg_verification_result):
         query_expansion_result = await query_expansion(question, kg_query_history_str, kg_final_answer, kg_verification_result)
         expanded_queries = parse_expanded_queries(query_expansion_result)
-    
-        for expanded_query in expanded_queries:
-            expanded_query_context = await grag_method.aquery_context(question=expanded_query)
-            # Relational Channel
-            expanded_query_context = grag_method.context_filter(context_data=expanded_query_context, filter_type="relational")
-            logging.info(f"Expanded KG Query Context: {expanded_query_context}")
-            
-            expanded_query_context_summary = await kg_summary(expanded_query, expanded_query_context)
-            logging.info(f"Expanded KG Query Context Summary: {expanded_query_context_summary}")
-            
-            kg_query_history.append((expanded_query, expanded_query_context_summary, ""))
-            
-        kg_query_history_str = format_history_context(kg_query_history)
-
-    combined_query_history_str = "Background information:\n" + grag_context_text_summary + "\n" + grag_context_kg_summary + "\n\n" + text_query_history_str + "\n\n" + kg_query_history_str
-    final_answer = await answer_generation_deep(question, combined_query_history_str)
-    logging.info(f"Final Answer: {final_answer}")
\ No newline at end of file
+        # Relational Channel
+        kg_query_history.extend(await answer_expanded_queries(
+            expanded_queries, grag_method, "relational", kg_summary, "Expanded KG Query", concurrent=concurrent, max_tokens=token_budget("kg_summary"), step="kg:expansion"
+        ))
+        kg_query_steps += ["kg:expansion"] * len(expanded_queries)
+
+    return kg_query_history, kg_query_steps
+
+def format_channel_histories(text_query_history:list, kg_query_history:list, max_tokens:int=None, text_keep=(), kg_keep=()):
+    text_query_history_str = format_history_context(text_query_history)
+    kg_query_history_str = format_history_context(kg_query_history)
+    if max_tokens is None or count_tokens(text_query_history_str) + count_tokens(kg_query_history_str) <= max_tokens:
+        return text_query_history_str, kg_query_history_str
+    # split the budget evenly, handing either channel's unused share to the other
+    text_share = max(max_tokens // 2, max_tokens - count_tokens(kg_query_history_str))
+    text_query_history_str = format_history_context(text_query_history, max_tokens=text_share, keep=text_keep)
+    kg_query_history_str = format_history_context(kg_query_history, max_tokens=max(max_tokens - count_tokens(text_query_history_str), 0), keep=kg_keep)
+    return text_query_history_str, kg_query_history_str
+
+@traced("graphsearch", kind="question", record=("question",))
+async def graph_search_reasoning(question:str, grag_method:GraphRAGBase, concurrent:bool=True):
+    logging.info("Starting graph search reasoning...")
+    # every distinct query is retrieved once per question, whichever channel asks first,
+    # all of the question's LLM calls go to the same replica, and each retrieved record
+    # is summarized once, unless a later step could not see that summary
+    with grag_method.retrieval_scope(), llm_session(question), (grag_method.seen_context_scope() if CONTEXT_DEDUP else nullcontext()) as seen, (prefix_scope() if prefix_stats_enabled() else nullcontext()) as prefix_tracker:
+        # Initial summaries and Question Decomposition are independent of each other
+        (grag_context_text_summary, grag_context_kg_summary), decomposition_output, kg_decomposition_output = await gather_stages(
+            initial_context_summary(question, grag_method, concurrent=concurrent),
+            question_decomposition_deep(question),
+            question_decomposition_deep_kg(question),
+            concurrent=concurrent
+        )
+
+        # Text and KG channels only meet again at the final answer
+        (text_query_history, text_query_steps), (kg_query_history, kg_query_steps) = await gather_stages(
+            text_channel_reasoning(question, decomposition_output, grag_method, concurrent=concurrent),
+            kg_channel_reasoning(question, kg_decomposition_output, grag_method, concurrent=concurrent),
+            concurrent=concurrent
+        )
+
+        background = "Background information:\n" + grag_context_text_summary + "\n" + grag_context_kg_summary
+        text_query_history_str, kg_query_history_str = format_channel_histories(
+            text_query_history, kg_query_history, remaining_budget("answer_generation_deep", background),
+            text_keep=relied_on_entries(grag_method, text_query_steps), kg_keep=relied_on_entries(grag_method, kg_query_steps)
+        )
+        if get_prompt_layout() == "prefix_cache":
+            # starts like the text channel's drafting prompts, so their prefix is reused
+            combined_query_history_str = text_query_history_str + "\n\n" + kg_query_history_str + "\n\n" + background
+        else:
+            combined_query_history_str = background + "\n\n" + text_query_history_str + "\n\n" + kg_query_history_str
+        final_answer = await answer_generation_deep(question, combined_query_history_str)
+        logging.info(f"Final Answer: {final_answer}")
+        if seen is not None:
+            logging.info(f"Context dedup: {seen.stats()}")
+            set_span_attributes(**seen.stats())
+        if prefix_tracker is not None:
+            logging.info(f"Prompt prefix sharing: {prefix_tracker.stats()}")
+            set_span_attributes(prompt_tokens_total=prefix_tracker.prompt_tokens, shared_prefix_tokens=prefix_tracker.shared_prefix_tokens)
+        return final_answer
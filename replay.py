@@ -0,0 +1,135 @@
+import gzip
+import json
+import time
+import asyncio
+import logging
+from collections import defaultdict
+
+FORMAT_VERSION = 1
+
+class ReplayMiss(LookupError):
+    """A call in strict replay mode that the recording has no response for."""
+
+class Recorder:
+    """
+    Appends every recorded call to a gzipped JSONL file: one header line, then
+    one line per call with its kind ("llm", "context", "data"), request hash,
+    start time, latency and response. Prompts are not stored, only their hash.
+    """
+
+    def __init__(self, path: str, metadata: dict | None = None):
+        self.path = path
+        self.calls = defaultdict(int)
+        self._epoch = time.perf_counter()
+        self._file = gzip.open(path, "wt", encoding="utf-8")
+        self._file.write(json.dumps({"version": FORMAT_VERSION, "created": time.time(), **(metadata or {})}) + "\n")
+
+    def record(self, kind: str, key: str, value, latency: float):
+        self.calls[kind] += 1
+        start = time.perf_counter() - self._epoch - latency
+        self._file.write(json.dumps({"k": kind, "h": key, "t": round(start, 4), "l": round(latency, 4), "v": value}, ensure_ascii=False) + "\n")
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+    def stats(self) -> dict:
+        return dict(self.calls)
+
+class Replayer:
+    """
+    Serves the responses of a `Recorder` file back by request hash. A request
+    recorded several times gets its responses in recorded order, then the last
+    one again. With `latency="recorded"` each response is delayed by its
+    recorded latency, with `"zero"` it is returned immediately. Unknown
+    requests raise `ReplayMiss` when `strict`, otherwise they run live.
+    """
+
+    def __init__(self, path: str, latency: str = "recorded", strict: bool = True):
+        if latency not in ("recorded", "zero"):
+            raise ValueError(f"latency must be 'recorded' or 'zero', got {latency!r}")
+        self.path = path
+        self.latency = latency
+        self.strict = strict
+        self.hits = defaultdict(int)
+        self.misses = defaultdict(int)
+        self._entries = defaultdict(list)
+        self._served = defaultdict(int)
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            self.metadata = json.loads(f.readline())
+            if self.metadata.get("version") != FORMAT_VERSION:
+                raise ValueError(f"{path}: unsupported recording version {self.metadata.get('version')}")
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # the recording process was killed mid-write
+                    logging.warning(f"{path}: ignoring truncated last entry")
+                    break
+                self._entries[(entry["k"], entry["h"])].append((entry["v"], entry["l"]))
+
+    def __contains__(self, kind_key: tuple[str, str]) -> bool:
+        return kind_key in self._entries
+
+    def lookup(self, kind: str, key: str) -> tuple | None:
+        """(response, latency) for the next call of this request, or None if it was never recorded."""
+        entries = self._entries.get((kind, key))
+        if entries is None:
+            self.misses[kind] += 1
+            if self.strict:
+                raise ReplayMiss(f"no recorded {kind} response for request {key}")
+            return None
+        self.hits[kind] += 1
+        i = self._served[(kind, key)]
+        self._served[(kind, key)] = i + 1
+        return entries[min(i, len(entries) - 1)]
+
+    async def serve(self, entry: tuple):
+        value, latency = entry
+        if self.latency == "recorded" and latency > 0:
+            await asyncio.sleep(latency)
+        return value
+
+    def stats(self) -> dict:
+        return {"hits": dict(self.hits), "misses": dict(self.misses)}
+
+_RECORDER: Recorder | None = None
+_REPLAYER: Replayer | None = None
+
+def enable_recording(path: str, metadata: dict | None = None) -> Recorder:
+    global _RECORDER
+    _RECORDER = Recorder(path, metadata)
+    return _RECORDER
+
+def enable_replay(path: str, latency: str = "recorded", strict: bool = True) -> Replayer:
+    global _REPLAYER
+    _REPLAYER = Replayer(path, latency, strict)
+    return _REPLAYER
+
+def get_recorder() -> Recorder | None:
+    """The active recorder, or None when recording is off."""
+    return _RECORDER
+
+def get_replayer() -> Replayer | None:
+    """The active replayer, or None when replay is off."""
+    return _REPLAYER
+
+async def replayable(kind: str, key: str, fetch, encode=None, decode=None):
+    """
+    Await `fetch()`, recording its result under (kind, key) while recording is
+    on, or serve the recorded result instead while replay is on. `encode` and
+    `decode` convert results that are not JSON serializable.
+    """
+    replayer = _REPLAYER
+    if replayer is not None:
+        entry = replayer.lookup(kind, key)
+        if entry is not None:
+            value = await replayer.serve(entry)
+            return decode(value) if decode is not None else value
+
+    start = time.perf_counter()
+    result = await fetch()
+    if _RECORDER is not None:
+        _RECORDER.record(kind, key, encode(result) if encode is not None else result, time.perf_counter() - start)
+    return result
@@ -0,0 +1,97 @@
+import os
+import json
+import time
+import asyncio
+import logging
+
+def load_questions(dataset: str):
+    with open(f"./datasets/questions/{dataset}.json", "r", encoding="utf-8") as f:
+        items = json.load(f)
+
+    questions = []
+    for i, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"question": item}
+        question_id = item.get("id", item.get("_id", i))
+        questions.append({**item, "id": str(question_id)})
+    return questions
+
+def end_partial_line(path: str):
+    """Terminate a last line cut off by a crash, so the next append starts a line of its own."""
+    with open(path, "rb+") as f:
+        f.seek(0, os.SEEK_END)
+        if f.tell() > 0:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) != b"\n":
+                f.write(b"\n")
+
+def load_completed_ids(output_file: str) -> set:
+    """Ids already written to `output_file`; a line cut off by a crash is ignored."""
+    if not os.path.exists(output_file):
+        return set()
+
+    completed = set()
+    with open(output_file, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                completed.add(json.loads(line)["id"])
+            except (json.JSONDecodeError, KeyError):
+                continue
+
+    end_partial_line(output_file)
+    return completed
+
+async def run_batch(questions: list, reason, output_file: str, concurrency: int):
+    """
+    Answer `questions` with `reason(question) -> answer`, keeping at most
+    `concurrency` questions in flight. Each result is appended to
+    `output_file` as soon as it finishes; questions already present in the
+    file are skipped, so an interrupted run can simply be restarted. Questions
+    that raise or get an empty answer are not written, so a restart retries them.
+    """
+    completed = load_completed_ids(output_file)
+    pending = [item for item in questions if item["id"] not in completed]
+    logging.info(f"{len(completed)} questions already answered, {len(pending)} to go")
+
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def run(item):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                prediction = await reason(item["question"])
+            except Exception:
+                logging.exception(f"Question {item['id']} failed")
+                return item, None, time.perf_counter() - start
+            return item, prediction, time.perf_counter() - start
+
+    os.makedirs(os.path.dirname(output_file) or ".", exist_ok=True)
+    latencies = []
+    failed = 0
+    with open(output_file, "a", encoding="utf-8") as f:
+        for finished in asyncio.as_completed([run(item) for item in pending]):
+            item, prediction, latency = await finished
+            # the deepsearch stages log their errors and return "", so an empty answer is a failure too
+            if prediction is None or not str(prediction).strip():
+                # left out of the output so a resumed run retries it
+                if prediction is not None:
+                    logging.warning(f"Question {item['id']} got an empty answer")
+                failed += 1
+                continue
+            record = {
+                "id": item["id"],
+                "question": item["question"],
+                "answer": item.get("answer"),
+                "prediction": prediction,
+                "latency": latency,
+            }
+            f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            f.flush()
+            latencies.append(latency)
+            logging.info(f"[{len(latencies)}/{len(pending)}] {item['id']} answered in {latency:.2f}s")
+
+    if latencies:
+        logging.info(f"Answered {len(latencies)} questions, mean latency {sum(latencies) / len(latencies):.2f}s")
+    if failed:
+        logging.warning(f"{failed} questions failed or got an empty answer; re-run to retry them")
+    return latencies
@@ -0,0 +1,129 @@
+import json
+import asyncio
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import pytest
+
+import llm.endpoints as endpoints
+from llm.endpoints import EndpointPool, llm_session
+from llm.client import get_openai_client, close_openai_clients
+
+class StubEndpoint:
+    """OpenAI-compatible stand-in that answers with its own name, or 503 while `failing`."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.failing = False
+        self.requests = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def _send(self, status, payload):
+                body = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if stub.failing:
+                    self._send(503, {"error": {"message": "unavailable"}})
+                else:
+                    self._send(200, {"object": "list", "data": [{"id": "stub", "object": "model"}]})
+
+            def do_POST(self):
+                self.rfile.read(int(self.headers["Content-Length"]))
+                stub.requests += 1
+                if stub.failing:
+                    self._send(503, {"error": {"message": "unavailable"}})
+                    return
+                self._send(200, {
+                    "id": "stub", "object": "chat.completion", "created": 0, "model": "stub",
+                    "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": stub.name}}],
+                })
+
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, daemon=True).start()
+        self.url = f"http://127.0.0.1:{self._server.server_address[1]}/v1/"
+
+    def shutdown(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+@pytest.fixture
+def stubs():
+    stubs = [StubEndpoint("a"), StubEndpoint("b")]
+    yield stubs
+    for stub in stubs:
+        stub.shutdown()
+
+async def complete(pool: EndpointPool) -> str:
+    response = await pool.run(lambda base_url: get_openai_client(base_url).chat.completions.create(
+        model="stub", messages=[{"role": "user", "content": "hi"}]
+    ))
+    return response.choices[0].message.content
+
+def test_failing_endpoint_is_ejected_and_readmitted(stubs, monkeypatch):
+    monkeypatch.setattr(endpoints, "LLM_EJECT_AFTER_FAILURES", 2)
+    monkeypatch.setattr(endpoints, "LLM_HEALTH_CHECK_INTERVAL", 0.0)
+    a, b = stubs
+    pool = EndpointPool([a.url, b.url], session_affinity=False)
+
+    async def run():
+        try:
+            a.failing = True
+            while not pool.stats()[a.url]["ejected"]:
+                try:
+                    await complete(pool)
+                except Exception:
+                    pass
+            assert a.requests == 2
+
+            # while ejected, everything goes to b and the health check keeps failing
+            failed_requests = a.requests
+            assert {await complete(pool) for _ in range(5)} == {"b"}
+            await asyncio.sleep(0.1)
+            assert a.requests == failed_requests and pool.stats()[a.url]["ejected"]
+
+            # once a answers its health check it is readmitted before LLM_EJECT_SECONDS
+            a.failing = False
+            pool.choose()
+            for _ in range(50):
+                if not pool.stats()[a.url]["ejected"]:
+                    break
+                await asyncio.sleep(0.05)
+            assert not pool.stats()[a.url]["ejected"]
+            answers = await asyncio.gather(*(complete(pool) for _ in range(8)))
+            assert "a" in answers
+        finally:
+            await close_openai_clients()
+
+    asyncio.run(run())
+
+def test_session_sticks_to_one_endpoint_until_it_is_ejected(stubs, monkeypatch):
+    monkeypatch.setattr(endpoints, "LLM_EJECT_AFTER_FAILURES", 1)
+    monkeypatch.setattr(endpoints, "LLM_HEALTH_CHECK_INTERVAL", None)
+    pool = EndpointPool([stub.url for stub in stubs], session_affinity=True)
+
+    async def run():
+        try:
+            with llm_session("question"):
+                first = await complete(pool)
+                assert set(await asyncio.gather(*(complete(pool) for _ in range(8)))) == {first}
+
+                sticky = next(stub for stub in stubs if stub.name == first)
+                sticky.failing = True
+                with pytest.raises(Exception):
+                    await complete(pool)
+                # the session moves to the healthy endpoint and stays there
+                assert {await complete(pool) for _ in range(4)} == {"b" if first == "a" else "a"}
+        finally:
+            await close_openai_clients()
+
+    asyncio.run(run())
@@ -0,0 +1,20 @@
+from graphrags.records import ChunkRecord, parse_csv_block, parse_csv_sections
+
+SOURCES = "id,\tcontent\n0,\tAlice met Bob.\nThey talked.\n1,\tThe harvest of crop Y starts in May."
+ENTITIES = "id,\tentity,\ttype,\tdescription\n0,\tALICE,\tperson,\tA farmer.\nShe grows crop Y.\n1,\tBOB,\tperson,\tA trader."
+
+def test_multiline_chunk_stays_one_row():
+    header, rows = parse_csv_block(SOURCES)
+    assert header == "id,\tcontent"
+    assert [row["content"] for row, _ in rows] == ["Alice met Bob.\nThey talked.", "The harvest of crop Y starts in May."]
+    assert "\n".join(raw for _, raw in rows) == SOURCES.partition("\n")[2]
+
+def test_multiline_entity_description_stays_one_row():
+    _, rows = parse_csv_block(ENTITIES)
+    assert [(row["entity"], row["description"]) for row, _ in rows] == [("ALICE", "A farmer.\nShe grows crop Y."), ("BOB", "A trader.")]
+
+def test_chunk_keys_are_distinct():
+    context = parse_csv_sections(f"-----Sources-----\n```csv\n{SOURCES}\n```\n", {"sources": ("-----Sources-----", "chunk")})
+    assert len({chunk.key for chunk in context.chunks}) == 2
+    # rows without a content column fall back to their raw line
+    assert ChunkRecord(content="", raw="0,\ta").key != ChunkRecord(content="", raw="1,\tb").key
@@ -0,0 +1,52 @@
+import asyncio
+
+from graphrags.records import ChunkRecord, StructuredContext
+from graphrags.seen import SeenRecords
+from benchmark.synthetic_kb import SyntheticGraphRAG, WhitespaceTokenizer
+from tokens import set_tokenizer
+from utils import format_history_context
+
+set_tokenizer(WhitespaceTokenizer())
+
+def chunks(*texts):
+    return StructuredContext(chunks=[ChunkRecord(content=text, raw=f"{i},\t{text}") for i, text in enumerate(texts)])
+
+def send(seen, context, step, after):
+    kept, skipped = seen.filter(context, step, after)
+    seen.claim(kept, step)
+    return [c.content for c in kept.chunks], skipped
+
+def test_record_from_the_first_retrieval_is_deduped_between_later_steps():
+    seen = SeenRecords()
+    seen.claim(chunks("a", "b"), "initial")
+    assert send(seen, chunks("a", "c"), "text:1", after=[]) == (["a", "c"], 0)
+    assert send(seen, chunks("a", "c", "d"), "text:2", after=["text:1"]) == (["d"], 2)
+
+def test_record_sent_by_an_unseen_step_is_kept():
+    seen = SeenRecords()
+    send(seen, chunks("a"), "text:1", after=[])
+    assert send(seen, chunks("a"), "text:2", after=[]) == (["a"], 0)
+
+def test_records_trimmed_for_the_budget_are_not_claimed():
+    kb = SyntheticGraphRAG(retrieval_latency=0)
+    question = kb.questions(1)[0]["question"]
+
+    async def run():
+        with kb.retrieval_scope(), kb.seen_context_scope() as seen:
+            trimmed = await kb.aquery_filtered_context(question, "semantic", max_tokens=60, step="text:1", after=[])
+            full = await kb.aquery_filtered_context(question, "semantic", step="text:2", after=["text:1"])
+            return trimmed, full, seen
+
+    trimmed, full, seen = asyncio.run(run())
+    # minus the header line
+    sent = trimmed.count(",\t") - 1
+    assert 0 < sent < kb.top_k
+    assert seen.records_skipped == sent
+    assert full.count(",\t") - 1 == kb.top_k - sent
+
+def test_history_keeps_the_context_of_relied_on_entries():
+    history = [(f"q{i}", f"summary {i} " + "word " * 20, f"a{i}") for i in range(3)]
+    rendered = format_history_context(history, max_tokens=40, keep={0})
+    assert "summary 0" in rendered
+    assert "summary 1" not in rendered
+    assert all(f"a{i}" in rendered for i in range(3))
@@ -0,0 +1,60 @@
+import threading
+from functools import lru_cache
+
+from utils import truncate_str_by_token_size
+from config import HUGGINGFACE_MODEL_NAME, CONTEXT_TOKEN_BUDGETS, TOKEN_COUNT_CACHE_SIZE, TOKEN_COUNT_CACHE_MAX_CHARS
+
+_TOKENIZER = None
+_TOKENIZER_LOCK = threading.Lock()
+
+def get_tokenizer():
+    """Load the fast tokenizer of HUGGINGFACE_MODEL_NAME once per process."""
+    global _TOKENIZER
+    if _TOKENIZER is None:
+        with _TOKENIZER_LOCK:
+            if _TOKENIZER is None:
+                from transformers import AutoTokenizer
+                _TOKENIZER = AutoTokenizer.from_pretrained(HUGGINGFACE_MODEL_NAME, use_fast=True)
+    return _TOKENIZER
+
+def set_tokenizer(tokenizer):
+    """
+    Use `tokenizer` instead of HUGGINGFACE_MODEL_NAME's, e.g. for offline
+    benchmarks. It needs `encode` and `decode`, and for prompt prefix
+    measurements a call returning an "offset_mapping" like a fast tokenizer's.
+    """
+    global _TOKENIZER
+    _TOKENIZER = tokenizer
+    _count_tokens.cache_clear()
+
+@lru_cache(maxsize=TOKEN_COUNT_CACHE_SIZE)
+def _count_tokens(text: str) -> int:
+    return len(get_tokenizer().encode(text, add_special_tokens=False))
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    # the same records and summaries are counted again for every prompt they go into; whole
+    # contexts and histories rarely repeat and would make the cache hold megabytes of text
+    if len(text) > TOKEN_COUNT_CACHE_MAX_CHARS:
+        return len(get_tokenizer().encode(text, add_special_tokens=False))
+    return _count_tokens(text)
+
+def token_budget(*stages: str) -> int | None:
+    """Context tokens allowed for a context shared by `stages` (the smallest of their budgets), or None if none is budgeted."""
+    budgets = [CONTEXT_TOKEN_BUDGETS[stage] for stage in stages if CONTEXT_TOKEN_BUDGETS.get(stage) is not None]
+    return min(budgets) if budgets else None
+
+def remaining_budget(stage: str, *texts: str) -> int | None:
+    """What is left of the stage's budget once `texts` are in the context, or None if it is not budgeted."""
+    budget = token_budget(stage)
+    if budget is None:
+        return None
+    return max(budget - sum(count_tokens(text) for text in texts), 0)
+
+def fit_to_budget(text: str, stage: str) -> str:
+    """Cut `text` to the stage's budget; a last resort for contexts the pipeline did not trim itself."""
+    budget = token_budget(stage)
+    if budget is None or count_tokens(text) <= budget:
+        return text
+    return truncate_str_by_token_size(text, budget, get_tokenizer())
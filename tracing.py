@@ -0,0 +1,144 @@
+import json
+import time
+import inspect
+import functools
+import itertools
+from dataclasses import dataclass, field, asdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+@dataclass
+class Span:
+    name: str
+    kind: str  # "question", "stage", "retrieval", "filter" or "llm"
+    span_id: int
+    parent_id: int | None
+    trace_id: int  # span_id of the root span, one per question
+    start: float  # seconds since the tracer started
+    end: float | None = None
+    attributes: dict = field(default_factory=dict)
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else self.start) - self.start
+
+class Tracer:
+    """Collects finished spans in memory; export them with `export_jsonl` or `export_chrome`."""
+
+    def __init__(self):
+        self.spans = []
+        self._ids = itertools.count(1)
+        self._epoch = time.perf_counter()
+
+    def now(self) -> float:
+        return time.perf_counter() - self._epoch
+
+    def next_id(self) -> int:
+        return next(self._ids)
+
+    def export_jsonl(self, path: str):
+        with open(path, "w", encoding="utf-8") as f:
+            for s in sorted(self.spans, key=lambda s: s.start):
+                f.write(json.dumps({**asdict(s), "duration": s.duration}, ensure_ascii=False) + "\n")
+
+    def export_chrome(self, path: str):
+        """
+        Chrome trace event format (chrome://tracing, Perfetto). Each question
+        is one async track and its spans nest by time, so concurrent stages of
+        the same question are drawn side by side.
+        """
+        events = []
+        for s in self.spans:
+            common = {"name": s.name, "cat": s.kind, "id": s.trace_id, "pid": 1, "tid": 1}
+            events.append({**common, "ph": "b", "ts": s.start * 1e6, "args": s.attributes})
+            events.append({**common, "ph": "e", "ts": (s.end if s.end is not None else s.start) * 1e6})
+        events.sort(key=lambda e: e["ts"])
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, ensure_ascii=False)
+
+    def export(self, path: str):
+        """Write JSONL for `*.jsonl` paths and a Chrome trace otherwise."""
+        if path.endswith(".jsonl"):
+            self.export_jsonl(path)
+        else:
+            self.export_chrome(path)
+
+    def summary(self) -> dict:
+        """Total wall time, span count and tokens per span name."""
+        totals = {}
+        for s in self.spans:
+            t = totals.setdefault(s.name, {"count": 0, "seconds": 0.0, "prompt_tokens": 0, "completion_tokens": 0})
+            t["count"] += 1
+            t["seconds"] += s.duration
+            t["prompt_tokens"] += s.attributes.get("prompt_tokens", 0)
+            t["completion_tokens"] += s.attributes.get("completion_tokens", 0)
+        return totals
+
+_TRACER: Tracer | None = None
+_CURRENT: ContextVar[Span | None] = ContextVar("current_span", default=None)
+
+def enable_tracing() -> Tracer:
+    global _TRACER
+    _TRACER = Tracer()
+    return _TRACER
+
+def get_tracer() -> Tracer | None:
+    """The active tracer, or None when tracing is off."""
+    return _TRACER
+
+@contextmanager
+def span(name: str, kind: str = "stage", **attributes):
+    """
+    Record a span around the block, nested under the current span (tasks
+    spawned inside inherit it). Yields None and records nothing while
+    tracing is off.
+    """
+    tracer = _TRACER
+    if tracer is None:
+        yield None
+        return
+
+    parent = _CURRENT.get()
+    span_id = tracer.next_id()
+    s = Span(
+        name=name,
+        kind=kind,
+        span_id=span_id,
+        parent_id=parent.span_id if parent is not None else None,
+        trace_id=parent.trace_id if parent is not None else span_id,
+        start=tracer.now(),
+        attributes=attributes,
+    )
+    token = _CURRENT.set(s)
+    try:
+        yield s
+    except BaseException as e:
+        s.attributes["error"] = type(e).__name__
+        raise
+    finally:
+        _CURRENT.reset(token)
+        s.end = tracer.now()
+        tracer.spans.append(s)
+
+def set_span_attributes(**attributes):
+    """Attach attributes (token counts, cache status, ...) to the current span, if any."""
+    s = _CURRENT.get()
+    if s is not None:
+        s.attributes.update(attributes)
+
+def traced(name: str, kind: str = "stage", record: tuple = ()):
+    """Wrap an async function in a span, storing the arguments named in `record` (truncated) as attributes."""
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if _TRACER is None:
+                return await func(*args, **kwargs)
+            bound = signature.bind(*args, **kwargs)
+            bound.apply_defaults()
+            attributes = {"function": func.__name__, **{k: str(bound.arguments[k])[:200] for k in record if k in bound.arguments}}
+            with span(name, kind, **attributes):
+                return await func(*args, **kwargs)
+        return wrapper
+    return decorator
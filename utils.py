@@ -1,11 +1,18 @@
 import json
 import re
-import os
+import time
 import asyncio
 from typing import Any, Dict, List, Tuple
-from openai import AsyncOpenAI
 
-from config import LLM_API_KEY, LLM_BASE_URL, MODEL_NAME, EMBED_MODEL_NAME
+from config import MODEL_NAME, LLM_CALL_TIMEOUT, LLM_HEDGE_STAGES, LLM_HEDGE_DELAY
+from llm.client import get_openai_client
+from llm.cache import get_llm_cache
+from llm.limiter import get_llm_limiter
+from llm.retry import call_with_retries
+from llm.endpoints import get_endpoint_pool
+from llm.prefix import get_prefix_tracker
+from tracing import traced, set_span_attributes
+from replay import get_recorder, get_replayer
 
 def compute_args_hash(*args: Any, cache_type: str | None = None) -> str:
     """Compute a hash for the given arguments.
@@ -25,64 +32,180 @@ def compute_args_hash(*args: Any, cache_type: str | None = None) -> str:
     # Compute MD5 hash
     return hashlib.md5(args_str.encode()).hexdigest()
 
+@traced("llm", kind="llm", record=("stage",))
 async def openai_complete(
     prompt,
     model="gpt-4o",
     system_prompt=None,
     history_messages=[],
     temperature=0.0,
+    stage="default",
     **kwargs,
 ) -> str:
     model = MODEL_NAME
-    openai_async_client = AsyncOpenAI(
-        api_key=LLM_API_KEY, base_url=LLM_BASE_URL
+    args_hash = compute_args_hash(
+        json.dumps([model, prompt, system_prompt, history_messages, temperature, kwargs], sort_keys=True, default=str),
+        cache_type="llm",
     )
 
+    prefix_tracker = get_prefix_tracker()
+    if prefix_tracker is not None:
+        _, shared_prefix_tokens = prefix_tracker.observe(stage, "\n".join([system_prompt or ""] + [m["content"] for m in history_messages] + [prompt]))
+        set_span_attributes(shared_prefix_tokens=shared_prefix_tokens)
+
+    replayer = get_replayer()
+    if replayer is not None:
+        entry = replayer.lookup("llm", args_hash)
+        if entry is not None:
+            set_span_attributes(cache="replay")
+            # hold a limiter slot for the recorded latency, so the replay is scheduled like the live run
+            return await get_llm_limiter().run(lambda: replayer.serve(entry))
+
+    recorder = get_recorder()
+    llm_cache = get_llm_cache()
+    if llm_cache is not None:
+        cached_response = await llm_cache.aget(args_hash)
+        if cached_response is not None:
+            set_span_attributes(cache="hit")
+            if recorder is not None:
+                recorder.record("llm", args_hash, cached_response, 0.0)
+            return cached_response
+    set_span_attributes(cache="miss" if llm_cache is not None else "disabled")
+
     messages = []
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
     messages.extend(history_messages)
     messages.append({"role": "user", "content": prompt})
 
-    response = await openai_async_client.chat.completions.create(
-        model=model, messages=messages, temperature=temperature, **kwargs
-    )
+    service_time = 0.0
 
-    return response.choices[0].message.content
+    async def request():
+        nonlocal service_time
+        start = time.perf_counter()
+        response = await get_endpoint_pool().run(
+            lambda base_url: asyncio.wait_for(
+                get_openai_client(base_url).chat.completions.create(
+                    model=model, messages=messages, temperature=temperature, **kwargs
+                ),
+                timeout=LLM_CALL_TIMEOUT,
+            )
+        )
+        service_time = time.perf_counter() - start
+        return response
 
-def load_vdb(dataset, documents):
-    import faiss
-    from sentence_transformers import SentenceTransformer
-    index_path = f"./db/vdb/{dataset}_index.faiss"
-    embed_model = SentenceTransformer(EMBED_MODEL_NAME, trust_remote_code=True)
+    async def attempt():
+        # the timeout covers the request itself, not the time spent queued in the limiter
+        return await get_llm_limiter().run(request)
 
-    if os.path.exists(index_path):
-        index = faiss.read_index(index_path)
-        return index, embed_model
-    
-    embeddings = embed_model.encode(documents, show_progress_bar=True)
-    dim = embeddings.shape[1]
-    index = faiss.IndexFlatL2(dim)
-    index.add(embeddings)
-    
-    os.makedirs(os.path.dirname(index_path), exist_ok=True)
-    faiss.write_index(index, index_path)
+    response = await call_with_retries(
+        attempt,
+        stage=stage,
+        hedge_delay=LLM_HEDGE_DELAY if stage in LLM_HEDGE_STAGES else None,
+    )
+    content = response.choices[0].message.content
+    if response.usage is not None:
+        set_span_attributes(prompt_tokens=response.usage.prompt_tokens, completion_tokens=response.usage.completion_tokens)
+
+    if llm_cache is not None and content is not None:
+        await llm_cache.aset(args_hash, content)
+    if recorder is not None and content is not None:
+        recorder.record("llm", args_hash, content, service_time)
+    return content
+
+def load_vdb(dataset, documents, kind=None, metric=None):
+    from embedding import get_embed_model
+    from vdb import VDB_INDEX, VDB_METRIC, index_path, open_index
+    kind, metric = kind or VDB_INDEX, metric or VDB_METRIC
+    embed_model = get_embed_model()
+    index = open_index(index_path(dataset, kind, metric), documents, embed_model, kind, metric)
     return index, embed_model
 
+def _gather_documents(documents, I):
+    # -1 pads rows where the index returned fewer than top_k hits
+    return [[documents[i] for i in row[row >= 0]] for row in I]
+
+def vdb_retrieve_batch(questions, documents, index, embed_model, top_k):
+    """Retrieve the top_k documents for every question with one encoder batch and one `index.search`."""
+    from embedding import encode_cached
+    if len(questions) == 0:
+        return []
+    unique_questions = list(dict.fromkeys(questions))
+    query_embeddings = encode_cached(embed_model, unique_questions)
+    _, I = index.search(query_embeddings, k=top_k)
+    retrieved = dict(zip(unique_questions, _gather_documents(documents, I)))
+    return [retrieved[question] for question in questions]
+
 def vdb_retrieve(question, documents, index, embed_model, top_k):
-    query_embedding = embed_model.encode([question])
-    _, I = index.search(query_embedding, k=top_k)
-    retrieved_docs = [documents[i] for i in I[0]]
-    return retrieved_docs
+    return vdb_retrieve_batch([question], documents, index, embed_model, top_k)[0]
+
+async def avdb_retrieve_batch(questions, documents, index, top_k):
+    from embedding import get_embedding_service
+    if len(questions) == 0:
+        return []
+    unique_questions = list(dict.fromkeys(questions))
+    query_embeddings = await get_embedding_service().encode(unique_questions)
+    _, I = index.search(query_embeddings, k=top_k)
+    retrieved = dict(zip(unique_questions, _gather_documents(documents, I)))
+    return [retrieved[question] for question in questions]
+
+async def avdb_retrieve(question, documents, index, top_k):
+    return (await avdb_retrieve_batch([question], documents, index, top_k))[0]
 
 def extract_words_str(text):
     return ' '.join(re.findall(r'[A-Za-z]+', text))
 
-def format_history_context(history):
-    history_context_str = ""
-    for i, (q, ctx_sum, a) in enumerate(history):
-        history_context_str += f"Sub-query {i + 1}: {q}\nRetrieved context:\n{ctx_sum}\nSub-query answer: {a}\n\n"
-    return history_context_str.strip()
+def format_history_context(history, numbers=None, max_tokens=None, keep=()):
+    """
+    Render (sub-query, context summary, answer) triples. With `max_tokens`,
+    the retrieved context of the oldest entries is left out until the rest
+    fits; their answers, which later steps build on, are always kept, and so
+    is the context of the entries (by index) in `keep`.
+    """
+    def entry(i, with_context):
+        q, ctx_sum, a = history[i]
+        number = numbers[i] if numbers is not None else i + 1
+        if with_context:
+            return f"Sub-query {number}: {q}\nRetrieved context:\n{ctx_sum}\nSub-query answer: {a}"
+        return f"Sub-query {number}: {q}\nSub-query answer: {a}"
+
+    entries = [entry(i, True) for i in range(len(history))]
+    if max_tokens is not None:
+        from tokens import count_tokens
+        total = sum(count_tokens(e) for e in entries)
+        for i in range(len(entries)):
+            if total <= max_tokens:
+                break
+            if i in keep:
+                continue
+            short = entry(i, False)
+            total -= count_tokens(entries[i]) - count_tokens(short)
+            entries[i] = short
+    return "\n\n".join(entries).strip()
+
+def parse_sub_query_dependencies(sub_queries):
+    """
+    Map each sub-query to the (0-based) indices of the earlier sub-queries
+    it references through `#N` placeholders. A `#` that cannot be resolved
+    to an earlier sub-query conservatively depends on all previous ones.
+    """
+    dependencies = []
+    for i, sub_query in enumerate(sub_queries):
+        refs = {int(n) - 1 for n in re.findall(r"#(\d+)", sub_query)}
+        refs = {r for r in refs if 0 <= r < i}
+        if "#" in sub_query and not refs:
+            refs = set(range(i))
+        dependencies.append(refs)
+    return dependencies
+
+def transitive_dependencies(dependencies):
+    closure = []
+    for deps in dependencies:
+        resolved = set(deps)
+        for d in deps:
+            resolved |= closure[d]
+        closure.append(resolved)
+    return closure
 
 def truncate_str_by_token_size(
     text: str,
@@ -0,0 +1,394 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import argparse
+
+import numpy as np
+
+from config import (
+    VDB_INDEX,
+    VDB_METRIC,
+    VDB_IVF_NLIST,
+    VDB_PQ_M,
+    VDB_HNSW_M,
+    VDB_HNSW_EF_CONSTRUCTION,
+    VDB_NPROBE,
+    VDB_EF_SEARCH,
+    VDB_TRAIN_SAMPLE,
+    VDB_MMAP
+)
+
+INDEX_KINDS = ["flat", "ivfpq", "hnsw", "sq8"]
+
+class VectorIndex:
+    """
+    A FAISS index plus the parameters it was built with. `search` has the
+    same signature as `faiss.Index.search` and normalises queries when the
+    index uses inner product over normalised embeddings.
+
+    With `id_to_doc`, the index holds stable document ids (see `open_index`)
+    and `search` translates them to positions in the current corpus,
+    skipping `tombstones` (ids of deleted documents that the index type
+    cannot remove in place).
+    """
+
+    def __init__(self, index, params: dict, id_to_doc: np.ndarray | None = None, tombstones: list[int] | None = None):
+        self.index = index
+        self.params = params
+        self.id_to_doc = id_to_doc
+        self.tombstones = tombstones or []
+
+    @property
+    def normalize(self) -> bool:
+        return self.params["metric"] == "ip"
+
+    @property
+    def ntotal(self) -> int:
+        return self.index.ntotal
+
+    def set_search_params(self, nprobe: int | None = None, ef_search: int | None = None):
+        import faiss
+        space = faiss.ParameterSpace()
+        if nprobe is not None and self.params["index"] == "ivfpq":
+            space.set_index_parameter(self.index, "nprobe", nprobe)
+            self.params["nprobe"] = nprobe
+        if ef_search is not None and self.params["index"] == "hnsw":
+            space.set_index_parameter(self.index, "efSearch", ef_search)
+            self.params["ef_search"] = ef_search
+
+    def _prepare(self, vectors: np.ndarray) -> np.ndarray:
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        if self.normalize:
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def add(self, embeddings: np.ndarray, ids: np.ndarray):
+        self.index.add_with_ids(self._prepare(embeddings), np.asarray(ids, dtype=np.int64))
+
+    def search(self, queries: np.ndarray, k: int):
+        queries = self._prepare(queries)
+        if self.id_to_doc is None:
+            return self.index.search(queries, k)
+
+        D, I = self.index.search(queries, k + len(self.tombstones))
+        positions = np.where(I >= 0, self.id_to_doc[np.clip(I, 0, None)], -1)
+        # move live hits to the front of each row, keeping their rank order
+        order = np.argsort(positions < 0, axis=1, kind="stable")[:, :k]
+        return np.take_along_axis(D, order, axis=1), np.take_along_axis(positions, order, axis=1)
+
+def index_path(dataset: str, kind: str = VDB_INDEX, metric: str = VDB_METRIC) -> str:
+    # the original exact L2 index keeps its historical location
+    if kind == "flat" and metric == "l2":
+        return f"./db/vdb/{dataset}_index.faiss"
+    return f"./db/vdb/{dataset}_{kind}_{metric}_index.faiss"
+
+def factory_string(kind: str, dim: int, ntotal: int, nlist: int | None = VDB_IVF_NLIST, pq_m: int = VDB_PQ_M, hnsw_m: int = VDB_HNSW_M) -> tuple[str, dict]:
+    if kind == "flat":
+        return "Flat", {}
+    if kind == "sq8":
+        return "SQ8", {}
+    if kind == "hnsw":
+        return f"HNSW{hnsw_m}", {"hnsw_m": hnsw_m}
+    if kind == "ivfpq":
+        # ~4*sqrt(n) lists, with at least ~39 training points per list
+        nlist = nlist or max(1, min(int(4 * np.sqrt(ntotal)), ntotal // 39))
+        if dim % pq_m != 0:
+            raise ValueError(f"PQ sub-quantizers ({pq_m}) must divide the embedding dimension ({dim})")
+        # 8-bit codebooks need ~39*256 training points; small corpora fall back to 4 bits
+        pq_bits = 8 if ntotal >= 39 * 256 else 4
+        return f"IVF{nlist},PQ{pq_m}x{pq_bits}", {"nlist": nlist, "pq_m": pq_m, "pq_bits": pq_bits}
+    raise ValueError(f"Unknown index kind: {kind}")
+
+def build_index(embeddings: np.ndarray, kind: str = VDB_INDEX, metric: str = VDB_METRIC, ids: np.ndarray | None = None, train_sample: int = VDB_TRAIN_SAMPLE, seed: int = 0) -> VectorIndex:
+    import faiss
+
+    embeddings = np.array(embeddings, dtype=np.float32)
+    if metric == "ip":
+        faiss.normalize_L2(embeddings)
+    ntotal, dim = embeddings.shape
+    factory, factory_params = factory_string(kind, dim, ntotal)
+    faiss_metric = faiss.METRIC_INNER_PRODUCT if metric == "ip" else faiss.METRIC_L2
+    index = faiss.index_factory(dim, factory, faiss_metric)
+    if kind == "hnsw":
+        index.hnsw.efConstruction = VDB_HNSW_EF_CONSTRUCTION
+
+    if not index.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = embeddings if ntotal <= train_sample else embeddings[rng.choice(ntotal, train_sample, replace=False)]
+        index.train(sample)
+    index = faiss.IndexIDMap2(index)
+    index.add_with_ids(embeddings, np.arange(ntotal, dtype=np.int64) if ids is None else np.asarray(ids, dtype=np.int64))
+
+    params = {"index": kind, "metric": metric, "factory": factory, "dim": dim, **factory_params}
+    vector_index = VectorIndex(index, params)
+    vector_index.set_search_params(nprobe=VDB_NPROBE, ef_search=VDB_EF_SEARCH)
+    return vector_index
+
+def save_index(vector_index: VectorIndex, path: str):
+    import faiss
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    faiss.write_index(vector_index.index, path)
+    with open(f"{path}.json", "w") as f:
+        json.dump(vector_index.params, f, indent=2)
+
+def read_index(path: str, mmap: bool = VDB_MMAP) -> VectorIndex:
+    """
+    Load an index saved by `save_index`. With `mmap` the vectors stay in the
+    file and are paged in on demand, so startup does not read the whole index
+    and processes serving the same index share it through the page cache.
+    """
+    import faiss
+    index = None
+    if mmap:
+        # IO_FLAG_MMAP_IFC maps flat/HNSW/SQ codes as well as IVF lists (faiss >= 1.10)
+        flag = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+        try:
+            index = faiss.read_index(path, flag)
+        except RuntimeError:
+            logging.warning(f"{path} cannot be memory-mapped, reading it into memory")
+    if index is None:
+        index = faiss.read_index(path)
+    if os.path.exists(f"{path}.json"):
+        with open(f"{path}.json", "r") as f:
+            params = json.load(f)
+    else:
+        # indexes written before parameters were recorded are exact L2
+        params = {"index": "flat", "metric": "l2", "factory": "Flat", "dim": index.d}
+    vector_index = VectorIndex(index, params)
+    vector_index.set_search_params(nprobe=params.get("nprobe", VDB_NPROBE), ef_search=params.get("ef_search", VDB_EF_SEARCH))
+    return vector_index
+
+class DocumentStore:
+    """
+    Read-only list of documents backed by a memory-mapped UTF-8 blob and an
+    array of byte offsets (`{path}.offsets.npy`). Indexing decodes only the
+    requested document, so retrieval touches the top_k documents it returns
+    rather than the whole corpus.
+    """
+
+    def __init__(self, blob_path: str, offsets_path: str, signature: dict | None = None):
+        self.blob_path = blob_path
+        # identifies this version of the blob, so a vector index can tell it is unchanged without hashing it
+        self.signature = signature
+        self.offsets = np.load(offsets_path, mmap_mode="r")
+        self._blob = np.memmap(blob_path, dtype=np.uint8, mode="r") if self.offsets[-1] > 0 else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self._blob[self.offsets[i]:self.offsets[i + 1]].tobytes().decode("utf-8")
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+def line_offsets(path: str, chunk_size: int = 1 << 24) -> np.ndarray:
+    """Byte offsets of every line start in `path`, plus the file size; the same split as `f.readlines()`."""
+    offsets = [np.zeros(1, dtype=np.uint64)]
+    position = 0
+    with open(path, "rb") as f:
+        while chunk := f.read(chunk_size):
+            newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == ord("\n"))
+            offsets.append((newlines + position + 1).astype(np.uint64))
+            position += len(chunk)
+    offsets = np.concatenate(offsets)
+    if offsets[-1] != position:
+        offsets = np.append(offsets, np.uint64(position))
+    return offsets
+
+def open_corpus(dataset: str) -> DocumentStore:
+    """
+    The documents of `./datasets/contexts/{dataset}.txt` (one per line) as a
+    DocumentStore over the file itself. The offsets are computed once and
+    rebuilt when the corpus file changes.
+    """
+    corpus_file = f"./datasets/contexts/{dataset}.txt"
+    offsets_path = f"./db/vdb/{dataset}_docs.offsets.npy"
+    stat = os.stat(corpus_file)
+    signature = {"size": stat.st_size, "mtime": stat.st_mtime}
+
+    meta_path = f"{offsets_path}.json"
+    if os.path.exists(offsets_path) and os.path.exists(meta_path):
+        with open(meta_path, "r") as f:
+            if json.load(f) == signature:
+                return DocumentStore(corpus_file, offsets_path, signature)
+
+    os.makedirs(os.path.dirname(offsets_path), exist_ok=True)
+    np.save(offsets_path, line_offsets(corpus_file))
+    with open(meta_path, "w") as f:
+        json.dump(signature, f)
+    return DocumentStore(corpus_file, offsets_path, signature)
+
+def encode_documents(embed_model, documents: list[str], metric: str = VDB_METRIC) -> np.ndarray:
+    return embed_model.encode(list(documents), show_progress_bar=True, normalize_embeddings=(metric == "ip"))
+
+def content_digest(document: str) -> bytes:
+    return hashlib.md5(document.encode("utf-8")).hexdigest().encode()
+
+def read_manifest(path: str) -> dict | None:
+    if not os.path.exists(f"{path}.manifest.json"):
+        return None
+    with open(f"{path}.manifest.json", "r") as f:
+        manifest = json.load(f)
+    manifest["hashes"] = np.load(f"{path}.hashes.npy")
+    return manifest
+
+def save_manifest(vector_index: VectorIndex, path: str, hashes: np.ndarray, corpus: dict):
+    """
+    Record which document (by content hash) each index id holds, where each id
+    sits in the corpus, and which corpus version the index was synced with.
+    """
+    np.save(f"{path}.hashes.npy", hashes)
+    np.save(f"{path}.docmap.npy", vector_index.id_to_doc)
+    manifest = {
+        "ntotal": int(vector_index.ntotal),
+        "next_id": len(hashes),
+        "tombstones": vector_index.tombstones,
+        "corpus": corpus,
+    }
+    with open(f"{path}.manifest.json", "w") as f:
+        json.dump(manifest, f)
+
+def document_positions(documents) -> dict[bytes, int]:
+    """Content hash -> position of its first occurrence; repeated documents share one vector."""
+    positions = {}
+    for position, document in enumerate(documents):
+        positions.setdefault(content_digest(document), position)
+    return positions
+
+def id_to_doc_map(hashes: np.ndarray, positions: dict[bytes, int]) -> np.ndarray:
+    return np.array([positions.get(h, -1) if h else -1 for h in hashes.tolist()], dtype=np.int64)
+
+def create_index(path: str, documents, embed_model, kind: str = VDB_INDEX, metric: str = VDB_METRIC, embeddings: np.ndarray | None = None) -> VectorIndex:
+    """Encode every distinct document (or take rows of precomputed `embeddings`), build the index and write it with its manifest."""
+    positions = document_positions(documents)
+    unique = list(positions.values())
+    if embeddings is None:
+        embeddings = encode_documents(embed_model, [documents[i] for i in unique], metric)
+    else:
+        embeddings = embeddings[unique]
+    vector_index = build_index(embeddings, kind=kind, metric=metric)
+    hashes = np.array(list(positions), dtype="S32")
+    vector_index.id_to_doc = id_to_doc_map(hashes, positions)
+    save_index(vector_index, path)
+    save_manifest(vector_index, path, hashes, {"count": len(documents), "signature": getattr(documents, "signature", None)})
+    return vector_index
+
+def sync_index(vector_index: VectorIndex, hashes: np.ndarray, documents, embed_model) -> tuple[np.ndarray, dict]:
+    """
+    Bring an index in line with `documents`: encode and add documents whose
+    hash it has not seen, and remove (or tombstone) ids whose document is
+    gone. A changed line counts as one removal plus one addition.
+    """
+    positions = document_positions(documents)
+    known = {h: i for i, h in enumerate(hashes.tolist()) if h}
+
+    removed = np.array([i for h, i in known.items() if h not in positions], dtype=np.int64)
+    if len(removed):
+        try:
+            vector_index.index.remove_ids(removed)
+        except RuntimeError:
+            # HNSW cannot delete in place; dead ids are skipped at search time
+            vector_index.tombstones = sorted(set(vector_index.tombstones) | set(removed.tolist()))
+        hashes = hashes.copy()
+        hashes[removed] = b""
+
+    added = [h for h in positions if h not in known]
+    if added:
+        embeddings = encode_documents(embed_model, [documents[positions[h]] for h in added], vector_index.params["metric"])
+        vector_index.add(embeddings, np.arange(len(hashes), len(hashes) + len(added)))
+        hashes = np.concatenate([hashes, np.array(added, dtype="S32")])
+
+    vector_index.id_to_doc = id_to_doc_map(hashes, positions)
+    return hashes, {"added": len(added), "removed": len(removed), "tombstones": len(vector_index.tombstones)}
+
+def open_index(path: str, documents, embed_model, kind: str = VDB_INDEX, metric: str = VDB_METRIC, mmap: bool = VDB_MMAP) -> VectorIndex:
+    """
+    Load the index at `path` for `documents`, updating it incrementally if the
+    corpus changed since it was written, or build it if it does not exist.
+    """
+    manifest = read_manifest(path) if os.path.exists(path) else None
+    if manifest is None:
+        if os.path.exists(path):
+            logging.warning(f"{path} has no manifest and cannot be matched to the corpus, rebuilding it")
+        create_index(path, documents, embed_model, kind, metric)
+        manifest = read_manifest(path)
+
+    corpus = {"count": len(documents), "signature": getattr(documents, "signature", None)}
+    unchanged = corpus["signature"] is not None and manifest["corpus"] == corpus
+    vector_index = read_index(path, mmap=mmap and unchanged)
+    if vector_index.ntotal != manifest["ntotal"] or len(manifest["hashes"]) != manifest["next_id"]:
+        raise ValueError(f"{path} does not match its manifest, delete the index to rebuild it")
+    vector_index.tombstones = manifest["tombstones"]
+
+    if unchanged:
+        vector_index.id_to_doc = np.load(f"{path}.docmap.npy", mmap_mode="r")
+        return vector_index
+
+    hashes, stats = sync_index(vector_index, manifest["hashes"], documents, embed_model)
+    logging.info(f"Synced {path} with the corpus: {stats}")
+    if len(vector_index.tombstones) > 0.1 * vector_index.ntotal:
+        logging.warning(f"{len(vector_index.tombstones)} of {vector_index.ntotal} vectors in {path} are tombstoned, delete the index to rebuild it")
+    if stats["added"] or stats["removed"]:
+        save_index(vector_index, path)
+    save_manifest(vector_index, path, hashes, corpus)
+    return vector_index
+
+def recall_report(embeddings: np.ndarray, queries: np.ndarray, kind: str, metric: str = VDB_METRIC, k: int = 5, sweep: list[int] | None = None) -> list[dict]:
+    """
+    Recall@k and per-query latency of `kind` against the exact flat index of
+    the same metric, for each nprobe (IVF-PQ) or efSearch (HNSW) in `sweep`.
+    """
+    flat = build_index(embeddings, kind="flat", metric=metric)
+    candidate = build_index(embeddings, kind=kind, metric=metric)
+
+    def timed_search(vector_index):
+        start = time.perf_counter()
+        _, I = vector_index.search(queries, k)
+        return I, (time.perf_counter() - start) / len(queries)
+
+    truth, flat_latency = timed_search(flat)
+    rows = [{"index": "flat", "param": None, "recall": 1.0, "latency_ms": flat_latency * 1000}]
+    for value in (sweep if sweep and kind in ("ivfpq", "hnsw") else [None]):
+        if kind == "ivfpq":
+            candidate.set_search_params(nprobe=value)
+        elif kind == "hnsw":
+            candidate.set_search_params(ef_search=value)
+        found, latency = timed_search(candidate)
+        recall = np.mean([len(set(t) & set(f)) / k for t, f in zip(truth, found)])
+        rows.append({"index": kind, "param": value, "recall": float(recall), "latency_ms": latency * 1000})
+    return rows
+
+if __name__ == "__main__":
+    from embedding import get_embed_model
+    from runner import load_questions
+
+    parser = argparse.ArgumentParser(description="Build a naive RAG vector index and report recall against exact search")
+    parser.add_argument("-d", "--dataset", default="musique", choices=["hotpotqa", "musique", "2wikimultihopqa", "agriculture", "hypertension", "legal"], help="Dataset to use.")
+    parser.add_argument("-i", "--index", default=VDB_INDEX, choices=INDEX_KINDS, help="Index type.")
+    parser.add_argument("--metric", default=VDB_METRIC, choices=["l2", "ip"], help="Distance metric; ip normalises embeddings.")
+    parser.add_argument("-k", "--top_k", default=5, type=int, help="top retrieved items.")
+    parser.add_argument("--queries", default=500, type=int, help="Number of dataset questions used as queries for the report.")
+    parser.add_argument("--sweep", nargs="*", type=int, default=[1, 4, 16, 64, 256], help="nprobe (IVF-PQ) or efSearch (HNSW) values to report.")
+    args = parser.parse_args()
+
+    documents = open_corpus(args.dataset)
+    questions = [item["question"] for item in load_questions(args.dataset)[:args.queries]]
+
+    embed_model = get_embed_model()
+    embeddings = encode_documents(embed_model, documents, args.metric)
+    queries = embed_model.encode(questions, normalize_embeddings=(args.metric == "ip"))
+
+    for row in recall_report(embeddings, queries, args.index, args.metric, args.top_k, args.sweep):
+        print(f"{row['index']:>6} param={row['param']!s:>5} recall@{args.top_k}={row['recall']:.3f} latency={row['latency_ms']:.3f}ms")
+
+    create_index(index_path(args.dataset, args.index, args.metric), documents, embed_model, args.index, args.metric, embeddings)